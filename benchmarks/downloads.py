@@ -0,0 +1,132 @@
+"""
+Benchmark of file downloads from a running DSM: measures the sustained download throughput of a
+(big) track or tacview file, while also measuring how long the status dashboard takes to answer
+during the downloads. Also checks that interrupted downloads can be resumed with byte ranges, and
+that files the browser already has aren't sent again.
+
+Example:
+python benchmarks/downloads.py --url http://localhost:9999 --path /dcs/tacviews \
+    --file huge_replay.zip.acmi --password secret
+"""
+from statistics import median
+import threading
+import time
+
+import click
+import requests
+
+
+CHUNK_BYTES = 1024 * 1024
+STATUS_EVERY_SECONDS = 0.5
+
+
+def download(session, url, params, results):
+    """
+    Download the file once, adding the bytes received and the time it took to the results.
+    """
+    started_at = time.monotonic()
+    received = 0
+    with session.get(url, params=params, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(CHUNK_BYTES):
+            received += len(chunk)
+    results.append((received, time.monotonic() - started_at))
+
+
+def poll_status(session, url, stop, latencies):
+    """
+    Ask for the status dashboard until stopped, adding how long each answer took to the latencies.
+    """
+    while not stop.is_set():
+        started_at = time.monotonic()
+        session.get(url).raise_for_status()
+        latencies.append(time.monotonic() - started_at)
+        stop.wait(STATUS_EVERY_SECONDS)
+
+
+def check_conditional(session, url, params):
+    """
+    Check that ranges and conditional requests work for the file.
+    """
+    full = session.head(url, params=params)
+    full.raise_for_status()
+    size = int(full.headers["Content-Length"])
+    click.echo(f"ETag: {full.headers.get('ETag')}, Last-Modified: "
+               f"{full.headers.get('Last-Modified')}, Accept-Ranges: "
+               f"{full.headers.get('Accept-Ranges')}")
+
+    # resume from the middle of the file
+    resumed = session.get(url, params=params, headers={"Range": f"bytes={size // 2}-"})
+    click.echo(f"Resume from the middle: {resumed.status_code}, "
+               f"{len(resumed.content)} of {size - size // 2} bytes expected, "
+               f"Content-Range: {resumed.headers.get('Content-Range')}")
+
+    # the browser already has it
+    cached = session.get(url, params=params, headers={"If-None-Match": full.headers["ETag"]})
+    click.echo(f"Already downloaded: {cached.status_code} (304 expected), "
+               f"{len(cached.content)} bytes sent")
+
+
+@click.command()
+@click.option("--url", default="http://localhost:9999", help="Base url of the DSM web UI")
+@click.option("--path", default="/dcs/tacviews",
+              help="Path of the files list (/dcs/tracks, /dcs/tacviews, /dcs/missions...)")
+@click.option("--file", "file_name", required=True, help="Name of the file to download")
+@click.option("--password", default="", help="Password of the DSM web UI, if any")
+@click.option("--clients", default=1, help="Number of downloads at the same time")
+@click.option("--rounds", default=3, help="Times each client downloads the file")
+def benchmark_downloads(url, path, file_name, password, clients, rounds):
+    """
+    Run the downloads benchmark.
+    """
+    session = requests.Session()
+    if password:
+        session.auth = ("admin", password)
+
+    files_url = url.rstrip("/") + path
+    params = {"download_file": file_name}
+
+    check_conditional(session, files_url, params)
+
+    results = []
+    latencies = []
+    stop = threading.Event()
+    status_thread = threading.Thread(
+        target=poll_status,
+        args=(session, url.rstrip("/") + "/global_status", stop, latencies),
+    )
+    status_thread.start()
+
+    def client():
+        client_session = requests.Session()
+        client_session.auth = session.auth
+        for _ in range(rounds):
+            download(client_session, files_url, params, results)
+
+    started_at = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started_at
+
+    stop.set()
+    status_thread.join()
+
+    total_bytes = sum(received for received, _ in results)
+    click.echo(f"Downloaded {total_bytes / 1024 ** 2:.0f}MB in {elapsed:.1f}s with {clients} "
+               f"clients: {total_bytes / 1024 ** 2 / elapsed:.0f}MB/s")
+    for received, seconds in results:
+        click.echo(f"    {received / 1024 ** 2:.0f}MB in {seconds:.1f}s: "
+                   f"{received / 1024 ** 2 / seconds:.0f}MB/s")
+
+    if latencies:
+        latencies.sort()
+        click.echo(f"Status dashboard during the downloads: {len(latencies)} requests, "
+                   f"median {median(latencies) * 1000:.0f}ms, "
+                   f"max {latencies[-1] * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    benchmark_downloads()
@@ -0,0 +1,106 @@
+"""
+Benchmark of the delivery of actions (pause, unpause) to the DCS server: a fake DCS hook waits
+for actions with long polls like the real one does, while actions are queued from the web UI, and
+the time from queuing each action until the fake hook gets it is measured. The fake hook also posts
+the mission status like the real one, so both channels are used at the same time.
+
+Example:
+python benchmarks/hook_actions.py --url http://localhost:9999 --password secret --actions 50
+"""
+from statistics import median
+import threading
+import time
+
+import click
+import requests
+
+
+ACTIONS_WAIT_SECONDS = 20
+STATUS_EVERY_SECONDS = 3
+
+
+def fake_hook(session, url, stop, received):
+    """
+    Wait for actions like the hook does, until stopped, acknowledging them and adding the time each
+    one was received to the received actions, by action id.
+    """
+    to_ack = []
+    while not stop.is_set():
+        response = session.post(url + "/dcs/actions",
+                                json={"ack": to_ack, "wait": ACTIONS_WAIT_SECONDS})
+        response.raise_for_status()
+        to_ack = []
+        for pending_action in response.json()["actions"]:
+            received.setdefault(pending_action["id"], (pending_action["action"], time.monotonic()))
+            to_ack.append(pending_action["id"])
+
+
+def post_status(session, url, stop):
+    """
+    Post the mission status like the hook does, until stopped.
+    """
+    sequence = 0
+    while not stop.is_set():
+        sequence += 1
+        session.post(url + "/dcs/mission_status", json={
+            "v": 2, "session": "benchmark", "seq": sequence, "full": True,
+            "mission": "Benchmark", "paused": False, "players": [],
+        }).raise_for_status()
+        stop.wait(STATUS_EVERY_SECONDS)
+
+
+@click.command()
+@click.option("--url", default="http://localhost:9999", help="Base url of the DSM web UI")
+@click.option("--password", default="", help="Password of the DSM web UI, if any")
+@click.option("--actions", "actions_count", default=20, help="Number of actions to queue")
+@click.option("--interval", default=0.5, help="Seconds between actions")
+def benchmark_hook_actions(url, password, actions_count, interval):
+    """
+    Run the actions delivery benchmark. Don't run it against a DSM with a real DCS server running,
+    its hook would get (and execute) the actions too.
+    """
+    url = url.rstrip("/")
+    session = requests.Session()
+    if password:
+        session.auth = ("admin", password)
+
+    received = {}
+    stop = threading.Event()
+    hook_session = requests.Session()
+    hook_session.auth = session.auth
+    status_session = requests.Session()
+    status_session.auth = session.auth
+    threads = [
+        threading.Thread(target=fake_hook, args=(hook_session, url, stop, received), daemon=True),
+        threading.Thread(target=post_status, args=(status_session, url, stop), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    for i in range(actions_count):
+        action = "pause" if i % 2 == 0 else "unpause"
+        already_received = set(received)
+        queued_at = time.monotonic()
+        session.post(f"{url}/dcs/{action}").raise_for_status()
+
+        # wait until the fake hook gets it
+        while not received.keys() - already_received:
+            if time.monotonic() - queued_at > ACTIONS_WAIT_SECONDS:
+                raise click.ClickException(f"The {action} action never arrived")
+            time.sleep(0.001)
+
+        new_id, = received.keys() - already_received
+        latencies.append(received[new_id][1] - queued_at)
+        time.sleep(interval)
+
+    # the fake hook stops after its current long poll ends
+    stop.set()
+
+    latencies.sort()
+    click.echo(f"{len(latencies)} actions delivered: median {median(latencies) * 1000:.1f}ms, "
+               f"max {latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    benchmark_hook_actions()
@@ -0,0 +1,190 @@
+"""
+Queue of actions for the DCS server to execute (pause, unpause...), delivered to the DSM hook
+running inside DCS.
+Each action has a unique id, and is delivered (in the order they were queued) until the hook
+acknowledges that it executed it, so an action isn't lost if an answer to the hook is. Actions are
+stored in a small SQLite database, so they also survive DSM restarts, and they expire if they
+aren't delivered in time, so a pause requested long ago doesn't surprise anyone.
+It is meant to be used as a singleton, like this:
+
+from dsm import actions
+actions.add("pause")
+print(actions.wait_pending(acknowledged_ids=[], wait=20))  # [{"id": 1, "action": "pause"}]
+"""
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+import sqlite3
+import threading
+
+from dsm import config, metrics
+
+
+logger = getLogger(__name__)
+
+
+# the hook waits for actions with long polls, each one answered as soon as there are actions, or
+# after this many seconds at most
+MAX_WAIT_SECONDS = 20
+
+# AUTOINCREMENT, so ids are never reused, not even after DSM restarts (the hook could still have
+# ids of actions from before to acknowledge)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    action TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    -- when it was last delivered to the hook, NULL if it never was
+    delivered_at REAL
+);
+"""
+
+
+connection = None
+# protects the connection, and is notified when actions are queued, to answer the waiting polls
+queue_changed = threading.Condition()
+
+
+def get_path():
+    """
+    Get the path to the actions database file.
+    """
+    config_path = Path(config.current_path)
+    return config_path.parent / "dsm_actions.db"
+
+
+def get_connection():
+    """
+    Get the connection to the actions database, creating the database if needed.
+    The connection is shared between threads, so it must only be used while holding
+    queue_changed.
+    """
+    global connection
+
+    if connection is None:
+        connection = sqlite3.connect(get_path(), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+    return connection
+
+
+def get_pending():
+    """
+    Get the pending actions, in order, forgetting the ones that expired: the ones never delivered
+    to the hook in time, and the ones delivered but not acknowledged since long ago (the hook
+    acknowledges them in its next poll, so it's gone). Must be called while holding queue_changed.
+    """
+    db = get_connection()
+    expire_seconds = config.current["DCS_ACTIONS_EXPIRE_SECONDS"]
+    if expire_seconds is not None:
+        expired_before = datetime.now().timestamp() - expire_seconds
+        expired = db.execute(
+            "SELECT id, action, delivered_at FROM actions "
+            "WHERE coalesce(delivered_at, queued_at) < ?",
+            (expired_before,),
+        ).fetchall()
+        for action_id, action, delivered_at in expired:
+            if delivered_at is None:
+                logger.warning("Action not delivered to the DCS server in time, discarded: %s",
+                               action, extra={"server": "dcs", "action": action})
+            else:
+                logger.warning("Action delivered to the DCS server but never acknowledged, "
+                               "discarded: %s", action, extra={"server": "dcs", "action": action})
+            db.execute("DELETE FROM actions WHERE id = ?", (action_id,))
+        if expired:
+            db.commit()
+
+    pending = db.execute("SELECT id, action, queued_at FROM actions ORDER BY id").fetchall()
+    metrics.set_gauge("dsm_dcs_pending_actions", len(pending))
+    return pending
+
+
+def add(action):
+    """
+    Queue an action for the DCS server. Requesting again the last action queued does nothing if
+    it's still pending (like clicking pause twice), but different actions are always queued, in
+    order.
+    Returns the id of the action.
+    """
+    with queue_changed:
+        pending = get_pending()
+        if pending and pending[-1][1] == action:
+            return pending[-1][0]
+
+        logger.info("Queue action to run in the DCS server: %s", action,
+                    extra={"server": "dcs", "action": action})
+        db = get_connection()
+        action_id = db.execute("INSERT INTO actions (action, queued_at) VALUES (?, ?)",
+                               (action, datetime.now().timestamp())).lastrowid
+        db.commit()
+        metrics.set_gauge("dsm_dcs_pending_actions", len(pending) + 1)
+        queue_changed.notify_all()
+
+    return action_id
+
+
+def acknowledge(action_ids):
+    """
+    Forget the actions that the hook executed. Must be called while holding queue_changed.
+    """
+    db = get_connection()
+    now = datetime.now().timestamp()
+    unknown_ids = set(action_ids)
+    for action_id, action, queued_at in get_pending():
+        if action_id in action_ids:
+            logger.info("Action executed by the DCS server: %s", action)
+            metrics.observe("dsm_dcs_action_delivery_seconds", now - queued_at)
+            db.execute("DELETE FROM actions WHERE id = ?", (action_id,))
+            unknown_ids.discard(action_id)
+    db.commit()
+
+    if unknown_ids:
+        # acknowledged again (the answer to the previous poll was lost), or after they expired
+        logger.info("The DCS server acknowledged actions no longer pending: %s",
+                    sorted(unknown_ids))
+
+
+def wait_pending(acknowledged_ids, wait):
+    """
+    Long poll for the pending actions: first forget the actions that the hook acknowledges it
+    executed, then wait up to some seconds until there are pending actions.
+    Returns [{"id": ..., "action": ...}], in the order they were queued.
+    """
+    with queue_changed:
+        if acknowledged_ids:
+            acknowledge(set(acknowledged_ids))
+
+        pending = get_pending()
+        if not pending:
+            queue_changed.wait(timeout=min(wait, MAX_WAIT_SECONDS))
+            pending = get_pending()
+
+        if pending:
+            db = get_connection()
+            now = datetime.now().timestamp()
+            db.executemany("UPDATE actions SET delivered_at = ? WHERE id = ?",
+                           ((now, action_id) for action_id, _, _ in pending))
+            db.commit()
+
+    return [{"id": action_id, "action": action} for action_id, action, _ in pending]
+
+
+def consume():
+    """
+    Get the pending actions for hooks installed by older versions of DSM, that get them in the
+    answers to their status posts and can't acknowledge them. Returned actions are forgotten, we
+    assume the server got them.
+    """
+    with queue_changed:
+        pending = get_pending()
+        if pending:
+            db = get_connection()
+            db.execute("DELETE FROM actions WHERE id <= ?", (pending[-1][0],))
+            db.commit()
+            metrics.set_gauge("dsm_dcs_pending_actions", 0)
+
+    actions = [action for _, action, _ in pending]
+    if actions:
+        logger.info("Actions consumed by the DCS server: %s", actions)
+    return actions
@@ -0,0 +1,296 @@
+"""
+Catalog of information extracted from the files shown in the UI (missions, tracks, tacviews...),
+stored in a small SQLite database so each file is only parsed once (or again if it changes).
+Extracting the information can take seconds for big files, so it's done in a pool of background
+processes, and the UI is notified when it's ready.
+It is meant to be used as a singleton, like this:
+
+from dsm import catalog, missions
+infos = catalog.request_infos(missions.CATALOG_KIND, missions_path, page.files, "some-trigger")
+print(infos["some.miz"])  # None until it's extracted
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging import getLogger
+from pathlib import Path
+import atexit
+import json
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+import psutil
+
+from dsm import config, events
+
+
+logger = getLogger(__name__)
+
+
+# a kind of file in the catalog: a function that extracts its information (it runs in another
+# process, so it must be a module level function), the namedtuple it returns, the version of the
+# extraction (increasing it extracts all the files again), the template that shows it, and the
+# fields of the information where the files can be searched
+Kind = namedtuple("Kind", "name extract info_type version template search_fields")
+
+# the DCS server is usually running in the same machine, so extraction doesn't use more than a
+# core. And it's not urgent, so it runs with low priority
+EXTRACT_WORKERS = 1
+# while many files are being extracted, the UI is notified at most this often
+NOTIFY_EVERY_SECONDS = 2
+# files waiting to be extracted at most. More are ignored until there's room, they will be
+# requested again the next time they are shown
+MAX_PENDING = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified_at REAL NOT NULL,
+    version INTEGER NOT NULL,
+    info TEXT,
+    search_text TEXT,
+    error TEXT,
+    PRIMARY KEY (kind, path)
+);
+"""
+
+
+connection = None
+connection_lock = threading.Lock()
+
+executor = None
+# files being extracted: {(kind name, path): trigger to notify the UI with when done}
+pending = {}
+pending_lock = threading.Lock()
+# when the UI was last notified, by trigger
+notified_at = {}
+
+
+def get_path():
+    """
+    Get the path to the catalog database file.
+    """
+    config_path = Path(config.current_path)
+    return config_path.parent / "dsm_catalog.db"
+
+
+def get_connection():
+    """
+    Get the connection to the catalog database, creating the database if needed.
+    The connection is shared between threads, so it must only be used while holding
+    connection_lock.
+    """
+    global connection
+
+    if connection is None:
+        connection = sqlite3.connect(get_path(), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+
+    return connection
+
+
+def lower_priority():
+    """
+    Make the current process run with low priority (used in the extraction processes).
+    """
+    process = psutil.Process()
+    if psutil.WINDOWS:
+        process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+    else:
+        process.nice(10)
+
+
+def get_executor():
+    """
+    Get the pool of processes that extract information from files, starting it if needed.
+    """
+    global executor
+
+    if executor is None:
+        # spawn, like on Windows, to not fork the web server threads
+        executor = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=lower_priority,
+        )
+
+    return executor
+
+
+def stop_executor():
+    """
+    Stop the pool of extraction processes, forgetting the extractions that didn't start yet.
+    """
+    global executor
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+atexit.register(stop_executor)
+
+
+def request_infos(kind, folder_path, file_infos, trigger):
+    """
+    Get the information of some files of a folder (files.FileInfo), from the catalog. Files that
+    aren't in the catalog yet (or changed since they were extracted) are extracted in the
+    background, and the UI is notified with the trigger when they are ready.
+    Returns {file name: info}, with None for the files not extracted yet or that failed to be
+    extracted.
+    """
+    paths = {str(Path(folder_path) / file_info.name): file_info for file_info in file_infos}
+    if not paths:
+        return {}
+
+    with connection_lock:
+        rows = get_connection().execute(
+            f"""
+            SELECT path, size, modified_at, version, info FROM entries
+            WHERE kind = ? AND path IN ({", ".join("?" * len(paths))})
+            """,
+            [kind.name] + list(paths),
+        ).fetchall()
+    entries = {path: (size, modified_at, version, info)
+               for path, size, modified_at, version, info in rows}
+
+    infos = {}
+    for path, file_info in paths.items():
+        infos[file_info.name] = None
+        size, modified_at, version, info = entries.get(path, (None, None, None, None))
+        if (size, modified_at, version) == (file_info.size, file_info.modified_at.timestamp(),
+                                            kind.version):
+            # if the extraction failed there's no info, no need to try again until it changes
+            if info is not None:
+                infos[file_info.name] = kind.info_type(**json.loads(info))
+        else:
+            submit(kind, path, file_info, trigger)
+
+    return infos
+
+
+def submit(kind, path, file_info, trigger):
+    """
+    Extract the information of a file in the background, unless it's already being extracted (or
+    there are too many files waiting already).
+    """
+    with pending_lock:
+        if (kind.name, path) in pending or len(pending) >= MAX_PENDING:
+            return
+        pending[(kind.name, path)] = trigger
+
+    try:
+        future = get_executor().submit(kind.extract, path)
+    except BrokenProcessPool:
+        # a process of the pool died (the next request will start a new pool)
+        logger.warning("The pool of extraction processes broke, starting it again")
+        stop_executor()
+        with pending_lock:
+            pending.pop((kind.name, path), None)
+        return
+
+    future.add_done_callback(
+        lambda future: save(kind, path, file_info, future)
+    )
+
+
+def save(kind, path, file_info, future):
+    """
+    Save the result of an extraction in the catalog, and notify the UI if needed.
+    """
+    if future.cancelled():
+        with pending_lock:
+            pending.pop((kind.name, path), None)
+        return
+
+    info, search_text, error = None, None, None
+    try:
+        result = future.result()
+        info = json.dumps(result._asdict())
+        search_text = as_search_text([getattr(result, field) for field in kind.search_fields])
+    except BrokenProcessPool:
+        # not the file's fault, it will be extracted again next time
+        with pending_lock:
+            pending.pop((kind.name, path), None)
+        return
+    except Exception as err:
+        logger.warning("Failed to extract the information of %s: %s", path, err)
+        error = str(err)
+
+    try:
+        with connection_lock:
+            db = get_connection()
+            db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(kind, path, size, modified_at, version, info, search_text, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind.name, path, file_info.size, file_info.modified_at.timestamp(), kind.version,
+                 info, search_text, error),
+            )
+            db.commit()
+    except sqlite3.Error as err:
+        logger.warning("Failed to save the information of %s to the catalog: %s", path, err)
+
+    with pending_lock:
+        trigger = pending.pop((kind.name, path), None)
+        more_pending = trigger in pending.values()
+        now = time.monotonic()
+        should_notify = (not more_pending
+                         or now - notified_at.get(trigger, 0) > NOTIFY_EVERY_SECONDS)
+        if should_notify:
+            notified_at[trigger] = now
+
+    if trigger and should_notify:
+        events.notify(trigger=trigger)
+
+
+def as_search_text(value):
+    """
+    Flatten the values of some information (lists, dicts, texts, numbers...) into a single
+    lowercase text, to search in it.
+    """
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(as_search_text(item) for item in value)
+    if value is None:
+        return ""
+    return str(value).lower()
+
+
+def search(kind, folder_path, text):
+    """
+    Search the files of a folder whose information contains a text (case insensitive). Only the
+    files already in the catalog can be found.
+    Returns the set of names of the matching files.
+    """
+    folder_path = Path(folder_path)
+    escaped_text = text.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    with connection_lock:
+        rows = get_connection().execute(
+            "SELECT path FROM entries WHERE kind = ? AND search_text LIKE ? ESCAPE '\\'",
+            (kind.name, f"%{escaped_text}%"),
+        ).fetchall()
+
+    return {Path(path).name for path, in rows if Path(path).parent == folder_path}
+
+
+def prune():
+    """
+    Forget the files that no longer exist.
+    """
+    with connection_lock:
+        paths = [row[0] for row in get_connection().execute("SELECT DISTINCT path FROM entries")]
+
+    missing = [path for path in paths if not Path(path).exists()]
+    if missing:
+        with connection_lock:
+            db = get_connection()
+            db.executemany("DELETE FROM entries WHERE path = ?", ((path,) for path in missing))
+            db.commit()
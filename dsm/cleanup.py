@@ -0,0 +1,194 @@
+"""
+Deletion of files in bulk in the background (so deleting hundreds of tracks doesn't keep a web
+request waiting), and retention policies that periodically delete old tracks and tacviews, so they
+don't fill up the disk.
+It is meant to be used as a singleton, like this:
+
+from dsm import cleanup
+task = cleanup.start_delete(tracks_path, ["a.trk", "b.trk"])
+cleanup.run_delete(task.id)  # usually in a background job
+print(cleanup.get_task(task.id).deleted)
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from logging import getLogger
+from pathlib import Path
+from uuid import uuid4
+import threading
+
+from dsm import config, files
+from dsm.exceptions import ImproperlyConfigured
+
+
+logger = getLogger(__name__)
+
+
+DeleteTask = namedtuple("DeleteTask", "id folder_path total deleted failed finished_at")
+RetentionPolicy = namedtuple("RetentionPolicy", "keep_days keep_max_mb keep_last")
+
+ENFORCE_RETENTION_EVERY_MINUTES = 60
+# files modified this recently might still be being written (like the track or tacview of the
+# current mission), retention policies never delete them
+RECENTLY_MODIFIED_SECONDS = 300
+# finished tasks are forgotten after this time, nobody will ask for their progress anymore
+FORGET_TASKS_AFTER_SECONDS = 600
+
+# lists of files with retention policies, and the prefix of their configs
+RETENTION_CONFIGS = {
+    "dcs-tracks": "DCS_TRACKS",
+    "dcs-tacviews": "DCS_TACVIEWS",
+}
+
+# delete tasks, by id, and the names of the files each one must delete
+tasks = {}
+tasks_files = {}
+tasks_lock = threading.Lock()
+
+
+def start_delete(folder_path, file_names):
+    """
+    Create a task to delete the specified files from a folder. The files are deleted when the task
+    is run with run_delete (usually in the background), and its progress can be checked meanwhile
+    with get_task.
+    """
+    task = DeleteTask(
+        id=uuid4().hex,
+        folder_path=Path(folder_path),
+        total=len(file_names),
+        deleted=0,
+        failed=0,
+        finished_at=None,
+    )
+
+    with tasks_lock:
+        forget_old_tasks()
+        tasks[task.id] = task
+        tasks_files[task.id] = list(file_names)
+
+    return task
+
+
+def run_delete(task_id):
+    """
+    Run a delete task, deleting its files one by one and updating its progress.
+    """
+    with tasks_lock:
+        task = tasks[task_id]
+        file_names = tasks_files.pop(task_id)
+
+    for file_name in file_names:
+        try:
+            (task.folder_path / file_name).unlink()
+            files.update(task.folder_path, file_name)
+            task = task._replace(deleted=task.deleted + 1)
+        except OSError as err:
+            logger.warning("Failed to delete %s: %s", task.folder_path / file_name, err)
+            task = task._replace(failed=task.failed + 1)
+
+        with tasks_lock:
+            tasks[task_id] = task
+
+    task = task._replace(finished_at=datetime.now())
+    with tasks_lock:
+        tasks[task_id] = task
+
+    logger.info("Deleted %s files from %s (%s failed)", task.deleted, task.folder_path,
+                task.failed)
+    return task
+
+
+def get_task(task_id):
+    """
+    Get the current progress of a delete task, or None if there is no such task.
+    """
+    with tasks_lock:
+        return tasks.get(task_id)
+
+
+def get_running_tasks(folder_path):
+    """
+    Get the delete tasks still running in a folder.
+    """
+    with tasks_lock:
+        return [
+            task for task in tasks.values()
+            if task.folder_path == Path(folder_path) and task.finished_at is None
+        ]
+
+
+def forget_old_tasks():
+    """
+    Forget the tasks that finished long ago. Must be called while holding tasks_lock.
+    """
+    oldest_allowed = datetime.now() - timedelta(seconds=FORGET_TASKS_AFTER_SECONDS)
+    for task_id, task in list(tasks.items()):
+        if task.finished_at is not None and task.finished_at < oldest_allowed:
+            del tasks[task_id]
+
+
+def get_policy(config_prefix):
+    """
+    Get the retention policy configured for a list of files.
+    """
+    return RetentionPolicy(
+        keep_days=config.current.get(f"{config_prefix}_KEEP_DAYS"),
+        keep_max_mb=config.current.get(f"{config_prefix}_KEEP_MAX_MB"),
+        keep_last=config.current.get(f"{config_prefix}_KEEP_LAST"),
+    )
+
+
+def files_to_delete(folder_path, glob_filter, policy):
+    """
+    Get the names of the files in a folder that must be deleted according to a retention policy:
+    the ones older than keep_days, the oldest ones that don't fit in keep_max_mb, and the ones
+    that aren't among the newest keep_last files.
+    """
+    index = files.get_index(folder_path)
+    with files.indexes_lock:
+        all_files = list(index.files.values())
+
+    newest_first = sorted(
+        (file_info for file_info in all_files if files.matches_filter(file_info.name, glob_filter)),
+        key=lambda file_info: file_info.modified_at,
+        reverse=True,
+    )
+
+    now = datetime.now()
+    recent_limit = now - timedelta(seconds=RECENTLY_MODIFIED_SECONDS)
+    total_bytes = 0
+    to_delete = []
+    for position, file_info in enumerate(newest_first):
+        total_bytes += file_info.size
+        if file_info.modified_at > recent_limit:
+            continue
+
+        if ((policy.keep_days and file_info.modified_at < now - timedelta(days=policy.keep_days))
+                or (policy.keep_max_mb and total_bytes > policy.keep_max_mb * 1024 ** 2)
+                or (policy.keep_last and position >= policy.keep_last)):
+            to_delete.append(file_info.name)
+
+    return to_delete
+
+
+def enforce_retention():
+    """
+    Delete the files that the configured retention policies don't want to keep anymore.
+    """
+    # to avoid a circular import
+    from dsm.web import FILES_VIEWS
+
+    for name, config_prefix in RETENTION_CONFIGS.items():
+        policy = get_policy(config_prefix)
+        if not any(policy):
+            continue
+
+        get_folder, glob_filter = FILES_VIEWS[name]
+        try:
+            folder_path = get_folder()
+        except ImproperlyConfigured:
+            continue
+
+        file_names = files_to_delete(folder_path, glob_filter, policy)
+        if file_names:
+            logger.info("Retention policy of %s: deleting %s files", name, len(file_names))
+            run_delete(start_delete(folder_path, file_names).id)
@@ -29,6 +29,11 @@ SPEC = {
     # general settings
     "DSM_SAVE_LOGS": Config(True, bool, "Wether to save logs to a file or not."),
     "DSM_LOG_FILE_PATH": Config("", Path, "Path where to save the log file."),
+    "DSM_LOG_ROTATE_AT_MB": Config(20, int, "When the log file reaches this size (in MB), it's archived (compressed) and a new log file is started. Leave empty to not rotate the logs based on size."),
+    "DSM_LOG_ROTATE_DAILY": Config(True, bool, "Whether to archive (compress) the log file and start a new one every day."),
+    "DSM_SAVE_STRUCTURED_LOGS": Config(False, bool, "Whether to also save the logs as json objects (one per line) with typed fields like server, status, resources, etc, in a .jsonl file next to the log file. Useful to read the logs from other tools."),
+    "DSM_LOG_KEEP_DAYS": Config(90, int, "Archived log files older than this (in days) are deleted. Leave empty to keep them forever."),
+    "DSM_SAVE_METRICS": Config(True, bool, "Whether to save the history of the servers status and resources usage (in a dsm_metrics.db file next to the config file)."),
     "DSM_PORT": Config(9999, int, "Port for the Server Manager web UI."),
     "DSM_HOST": Config("0.0.0.0", str, "Host for the Server Manager web UI (use 0.0.0.0 if you want to be able to connect from other computers)."),
     "DSM_PASSWORD": Config("", str, "Password for the Server Manager web UI (user is 'admin'). If you forget it, you can always manually edit the config file."),
@@ -44,6 +49,15 @@ SPEC = {
     "DCS_RESTART_IF_NOT_RESPONSIVE": Config(True, bool, "Whether to restart the DCS server if it is not responsive when the checks are done (for instance, when the mission scripts raise an error the server gets stuck). This is useful if you want to make sure the server is always running."),
     "DCS_RESTART_DAILY_AT_HOUR": Config(None, int, "Hour at which to restart the DCS server daily. This is useful if you want to 'reset' the server to a clean state every day, or deal with memory leaks, etc. If not set, the server will not be restarted daily."),
     "DCS_BOOT_TIMEOUT_SECONDS": Config(120, int, "How long to wait for the DCS server to boot before considering it as not responsive."),
+    "DCS_RESPONSIVENESS_TIMEOUT_SECONDS": Config(5, int, "How long to wait for the DCS server to answer the responsiveness checks before considering that check as failed."),
+    "DCS_NON_RESPONSIVE_AFTER_FAILED_CHECKS": Config(3, int, "How many responsiveness checks in a row must fail before considering the DCS server as not responsive. A single slow answer doesn't mean the server is frozen."),
+    "DCS_ACTIONS_EXPIRE_SECONDS": Config(300, int, "Actions requested to the DCS server (like pausing or unpausing the mission) that can't be delivered to it in this many seconds are discarded, so they aren't executed long after they were requested (for instance, if the server was stopped). Leave empty to never discard them."),
+    "DCS_TRACKS_KEEP_DAYS": Config(None, int, "Track files older than this (in days) are automatically deleted. Leave empty to not delete tracks based on their age."),
+    "DCS_TRACKS_KEEP_MAX_MB": Config(None, int, "When the track files use more than this (in MB), the oldest ones are automatically deleted. Leave empty to not delete tracks based on their size."),
+    "DCS_TRACKS_KEEP_LAST": Config(None, int, "Only keep this number of track files, the oldest ones are automatically deleted. Leave empty to not delete tracks based on how many there are."),
+    "DCS_TACVIEWS_KEEP_DAYS": Config(None, int, "Tacview files older than this (in days) are automatically deleted. Leave empty to not delete tacviews based on their age."),
+    "DCS_TACVIEWS_KEEP_MAX_MB": Config(None, int, "When the tacview files use more than this (in MB), the oldest ones are automatically deleted. Leave empty to not delete tacviews based on their size."),
+    "DCS_TACVIEWS_KEEP_LAST": Config(None, int, "Only keep this number of tacview files, the oldest ones are automatically deleted. Leave empty to not delete tacviews based on how many there are."),
 
     # srs server configs
     "SRS_EXE_PATH": Config(r"C:\Program Files\DCS-SimpleRadio-Standalone\SR-Server.exe", Path, "Full path of the SRS server executable, usually called SR-Server.exe"),
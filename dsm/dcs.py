@@ -16,10 +16,12 @@ from logging import getLogger
 from enum import Enum
 from pathlib import Path
 import re
+import threading
+import time
 
 import requests
 
-from dsm import config, processes, VERSION
+from dsm import config, metrics, processes, VERSION
 from dsm.exceptions import ImproperlyConfigured
 
 
@@ -32,7 +34,27 @@ MissionStatus = namedtuple("MissionStatus", "updated_at mission players paused")
 
 last_start = datetime.now()
 last_mission_status = None
-pending_actions = []  # actions that are pending to be executed by the DCS server, like pausing, etc
+# when the hook last posted, even if nothing changed (the mission status is only rebuilt when
+# something changes)
+last_hook_post_at = None
+
+# state of the hook protocol v2, where the hook only posts what changed since its previous post:
+# the hook session (it changes each time the hook is loaded), the sequence number of the last
+# post applied, and the players by id
+hook_session = None
+hook_sequence = None
+hook_players = {}
+hook_lock = threading.Lock()
+
+# the responsiveness checks reuse connections, and after a failed check the next one is delayed
+# more and more (up to a limit), so a frozen server doesn't keep us busy waiting for timeouts
+probe_session = requests.Session()
+probe_lock = threading.Lock()
+probe_failures = 0
+probe_next_at = 0
+probe_latency = None  # ms, of the last successful check
+PROBE_MIN_INTERVAL_SECONDS = 2
+PROBE_MAX_INTERVAL_SECONDS = 20
 
 
 MISSION_FILE_EXTENSION = "miz"
@@ -49,40 +71,81 @@ PRETENSE_PERSISTENCE_LINES = (
 )
 
 
-def is_responsive():
+def probe():
     """
-    Check if the DCS server is responsive (if not it's probably because it's frozen with an error).
-    We consider it responsive when it answers a specific request that we got from
+    Check if the DCS server answers a specific request that we got from
     https://github.com/ActiumDev/dcs-server-wine/blob/main/bin/dcs-watchdog.py
+    If it does, record how long it took to answer.
     """
+    global probe_latency
+
     url = f"http://localhost:{config.current['DCS_WEB_UI_PORT']}/encryptedRequest"
     body = {"ct": "/E5LnS99K/cq4BfuE9SwhgOVyvoFAD1FoJ+N0GhmhKg=", "iv": "rNuGPsuOIrY4NogYU01HIw=="}
+    timeout = config.current["DCS_RESPONSIVENESS_TIMEOUT_SECONDS"] or 5
 
     try:
-        response = requests.post(url, json=body, timeout=30)
+        probe_start = time.monotonic()
+        response = probe_session.post(url, json=body, timeout=timeout)
         if response.status_code == 200:
+            probe_latency = round((time.monotonic() - probe_start) * 1000)
             return True
     except Exception as err:
-        logger.debug(
-            "Assuming DCS server not responsive after failing to answer responsiveness check: %s",
-            type(err),
-        )
+        logger.debug("DCS server failed to answer responsiveness check: %s", type(err))
 
+    probe_latency = None
     return False
 
 
+def is_responsive(force_check=False):
+    """
+    Check if the DCS server is responsive (if not it's probably because it's frozen with an error).
+    We consider it not responsive only after a few checks in a row have failed.
+
+    Checks are done at most every few seconds (more spaced after failures), in between we answer
+    based on the latest checks. Unless force_check is True, in which case we always do a new check.
+    """
+    global probe_failures
+    global probe_next_at
+
+    max_failures = config.current["DCS_NON_RESPONSIVE_AFTER_FAILED_CHECKS"] or 1
+
+    if force_check:
+        probe_lock.acquire()
+    elif not probe_lock.acquire(blocking=False):
+        # someone else is already checking, no need to wait for them
+        return probe_failures < max_failures
+
+    try:
+        now = time.monotonic()
+        if force_check or now >= probe_next_at:
+            if probe():
+                probe_failures = 0
+                probe_next_at = now + PROBE_MIN_INTERVAL_SECONDS
+            else:
+                probe_failures += 1
+                logger.debug("DCS server responsiveness checks failed in a row: %s", probe_failures)
+                probe_next_at = now + min(PROBE_MIN_INTERVAL_SECONDS * 2 ** probe_failures,
+                                          PROBE_MAX_INTERVAL_SECONDS)
+
+        return probe_failures < max_failures
+    finally:
+        probe_lock.release()
+
+
 @config.require("DCS_EXE_PATH")
-def current_status():
+def current_status(force_check=False):
     """
     Check if the DCS server is up and running.
+    If force_check is True, the responsiveness of the server is checked again instead of using the
+    latest checks.
     """
     exe_path = config.current["DCS_EXE_PATH"]
     exe_name = processes.get_exe_name(exe_path)
 
-    process = processes.find(exe_name)
+    process = processes.get_process(exe_name)
 
     if process:
-        if is_responsive():
+        if is_responsive(force_check):
             mission_status = current_mission_status()
             if mission_status and isinstance(mission_status.paused, bool):
                 if mission_status.paused:
@@ -112,20 +175,40 @@ def current_resources():
     return processes.find(exe_name)
 
 
+@config.require("DCS_EXE_PATH")
+def sample_resources():
+    """
+    Take a new sample of the resources used by the DCS server, to be served by current_resources.
+    """
+    exe_path = config.current["DCS_EXE_PATH"]
+    exe_name = processes.get_exe_name(exe_path)
+
+    processes.sample(exe_name)
+
+
 @config.require("DCS_EXE_PATH")
 def start():
     """
     Start the DCS server.
     """
     global last_start
+    global probe_failures
+    global probe_next_at
 
     exe_path = config.current["DCS_EXE_PATH"]
     arguments = config.current["DCS_EXE_ARGUMENTS"]
 
     logger.info("Starting DCS server...")
+    start_time = time.monotonic()
     processes.start(exe_path, arguments)
+    metrics.increment("dsm_server_starts_total", server="dcs")
     last_start = datetime.now()
-    logger.info("DCS server started")
+    # failed checks from before don't count for the new server process
+    probe_failures = 0
+    probe_next_at = 0
+    logger.info("DCS server started", extra={
+        "server": "dcs", "action": "start", "duration": time.monotonic() - start_time,
+    })
 
 
 @config.require("DCS_EXE_PATH")
@@ -137,8 +220,12 @@ def stop(kill=False):
     exe_name = processes.get_exe_name(exe_path)
 
     logger.info("Stopping the DCS server... (kill=%s)", kill)
+    stop_time = time.monotonic()
     processes.stop(exe_name, kill=kill)
-    logger.info("DCS server stop signal sent")
+    logger.info("DCS server stop signal sent", extra={
+        "server": "dcs", "action": "kill" if kill else "stop",
+        "duration": time.monotonic() - stop_time,
+    })
 
 
 @config.require("DCS_EXE_PATH")
@@ -151,12 +238,16 @@ def restart():
     exe_name = processes.get_exe_name(exe_path)
 
     logger.info("Restarting DCS server...")
+    restart_time = time.monotonic()
+    metrics.increment("dsm_server_restarts_total", server="dcs")
     stopped = processes.ensure_stopped(exe_name, stop_timeout=30, kill_timeout=5)
 
     if not stopped:
         raise RuntimeError("Failed to stop the DCS server, even after force killing it")
 
-    logger.info("DCS process stopped, starting again...")
+    logger.info("DCS process stopped, starting again...", extra={
+        "server": "dcs", "action": "restart", "duration": time.monotonic() - restart_time,
+    })
     start()
 
 
@@ -168,16 +259,18 @@ def ensure_up():
     restart_if_not_running = config.current["DCS_RESTART_IF_NOT_RUNNING"]
     restart_if_not_responsive = config.current["DCS_RESTART_IF_NOT_RESPONSIVE"]
 
-    status = current_status()
+    # we might restart the server based on this, so better be sure with a fresh check
+    status = current_status(force_check=True)
     resources = current_resources()
     mission_status = current_mission_status()
 
     if resources:
         resources_bit = (
             f"ram:{resources.memory}MB "
-            f"cpu:{resources.cpu}% "
+            f"cpu:{'?' if resources.cpu is None else resources.cpu}% "
             f"threads:{resources.threads} "
-            f"subprocs:{resources.child_processes}"
+            f"subprocs:{resources.child_processes} "
+            f"latency:{'?' if probe_latency is None else probe_latency}ms"
         )
     else:
         resources_bit = ""
@@ -190,7 +283,14 @@ def ensure_up():
     else:
         mission_bit = ""
 
-    logger.info("DCS server status: %s %s %s", status.name, resources_bit, mission_bit)
+    logger.info("DCS server status: %s %s %s", status.name, resources_bit, mission_bit, extra={
+        "server": "dcs",
+        "status": status,
+        "resources": resources,
+        "latency": probe_latency,
+        "mission": mission_status.mission if mission_status else None,
+        "players": mission_status.players if mission_status else None,
+    })
 
     try:
         if status == DCSServerStatus.NOT_RUNNING and restart_if_not_running:
@@ -324,8 +424,8 @@ def current_mission_status():
     """
     Get the current mission status, if it's known and fresh enough (otherwise, return None).
     """
-    if last_mission_status:
-        if datetime.now() - last_mission_status.updated_at < MISSION_STATUS_MAX_LIFE:
+    if last_mission_status and last_hook_post_at:
+        if datetime.now() - last_hook_post_at < MISSION_STATUS_MAX_LIFE:
             return last_mission_status
 
 
@@ -334,6 +434,7 @@ def set_mission_status(mission, players, paused):
     Set the current mission status, recording also the time of the update.
     """
     global last_mission_status
+    global last_hook_post_at
 
     # for some reason, dcs lists the server as a player itself
     if players and players[0].strip() == "Server":
@@ -345,29 +446,94 @@ def set_mission_status(mission, players, paused):
         players=players,
         paused=paused,
     )
+    last_hook_post_at = last_mission_status.updated_at
+
+
+def is_player_id(value):
+    """
+    Check if a value posted by the hook is a valid player id.
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_hook_players(players):
+    """
+    Parse the players posted by the hook, as {player_id: name}.
+    Returns None if they are malformed.
+    """
+    if players is None:
+        return {}
+    if not isinstance(players, list):
+        return None
+
+    parsed = {}
+    for player in players:
+        if not (isinstance(player, dict)
+                and is_player_id(player.get("id"))
+                and isinstance(player.get("name"), str)):
+            return None
+        parsed[player["id"]] = player["name"]
+    return parsed
+
+
+def apply_hook_update(update):
+    """
+    Apply an update posted by the hook with the protocol v2: either a full snapshot of the mission
+    status (with "full": true), or only what changed since the previous update ("mission",
+    "paused", "joined" and "left" players, each one only if it changed). Updates have the session
+    of the hook and a sequence number, so missing updates can be detected.
+    Returns False if the update can't be applied because a previous one was missed or it's
+    malformed, so the hook must send a full snapshot.
+    """
+    global hook_session
+    global hook_sequence
+    global last_hook_post_at
+
+    with hook_lock:
+        if update.get("full"):
+            players = parse_hook_players(update.get("players"))
+            if players is None:
+                logger.warning("Malformed players in an update from the DCS hook, asking for a "
+                               "full snapshot")
+                return False
+            hook_players.clear()
+            hook_players.update(players)
+            mission = update.get("mission", "Unknown")
+            paused = update.get("paused", "Unknown")
+        elif (last_mission_status is not None
+              and update.get("session") == hook_session
+              and update.get("seq") == hook_sequence + 1):
+            joined = parse_hook_players(update.get("joined"))
+            left = update.get("left") or []
+            if (joined is None or not isinstance(left, list)
+                    or not all(is_player_id(player_id) for player_id in left)):
+                logger.warning("Malformed players in an update from the DCS hook, asking for a "
+                               "full snapshot")
+                return False
+            for player_id in left:
+                hook_players.pop(player_id, None)
+            hook_players.update(joined)
+            mission = update.get("mission", last_mission_status.mission)
+            paused = update.get("paused", last_mission_status.paused)
+        else:
+            logger.debug("Missed updates from the DCS hook, asking for a full snapshot")
+            return False
 
+        hook_session = update.get("session")
+        hook_sequence = update.get("seq")
 
-def consume_pending_actions():
-    """
-    Get the pending actions that are to be executed by the DCS server.
-    This is used to pause, resume, etc. the mission.
-    Returned actions are removed (consumed) from the queue, we assume the server got them.
-    """
-    actions = pending_actions.copy()
-    pending_actions.clear()
-    if actions:
-        logger.info("Actions consumed by the DCS server: %s", actions)
-    return actions
-
+        if update.get("full") or any(key in update for key in ("mission", "paused", "joined",
+                                                              "left")):
+            set_mission_status(
+                mission=mission,
+                players=[name for _, name in sorted(hook_players.items())],
+                paused=paused,
+            )
+        else:
+            # nothing changed, it's just alive
+            last_hook_post_at = datetime.now()
 
-def add_pending_action(action):
-    """
-    Add an action to the pending actions queue.
-    This is used to pause, resume, etc the mission.
-    """
-    if action not in pending_actions:
-        logger.info("Queue action to run in the DCS server: %s", action)
-        pending_actions.append(action)
+    return True
 
 
 @config.require("DCS_EXE_PATH")
@@ -0,0 +1,63 @@
+"""
+Notifications about things that changed and might need to be shown in the web UI, so changes can
+be pushed to the browsers instead of them having to ask every few seconds.
+It is meant to be used as a singleton, like this:
+
+from dsm import events
+events.notify()  # something changed
+events.notify(trigger="files-changed-dcs-tracks")  # something changed, with a trigger for the UI
+version = events.wait(version, timeout=15)  # wait for something to change
+print(events.triggers_since(version))
+"""
+from collections import deque
+import threading
+
+
+# incremented every time something changes, so waiters can know if they missed changes
+version = 0
+changes = threading.Condition()
+
+# the latest triggers (names of events the UI reacts to, like reloading a files list) with the
+# version in which they happened. Only the latest ones are kept, as they are only useful for
+# the waiters that are following the changes
+MAX_TRIGGERS = 100
+triggers = deque(maxlen=MAX_TRIGGERS)
+
+
+def notify(trigger=None):
+    """
+    Let everyone waiting for changes know that something changed. A trigger can be specified, to
+    let the UI know something specific that it must react to.
+    """
+    global version
+
+    with changes:
+        version += 1
+        if trigger:
+            triggers.append((version, trigger))
+        changes.notify_all()
+
+
+def triggers_since(last_version):
+    """
+    Get the (unique) triggers that happened after the specified version.
+    """
+    with changes:
+        return list(dict.fromkeys(
+            trigger
+            for trigger_version, trigger in triggers
+            if last_version is not None and trigger_version > last_version
+        ))
+
+
+def wait(last_version, timeout):
+    """
+    Wait until something changes after the specified version, or until the timeout (in seconds) is
+    reached. Returns the current version, so it can be used in the next wait.
+    If last_version is None, returns immediately.
+    """
+    with changes:
+        if last_version is not None:
+            changes.wait_for(lambda: version != last_version, timeout=timeout)
+
+        return version
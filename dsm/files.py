@@ -0,0 +1,372 @@
+"""
+Index of the files in the folders that DSM shows in the web UI (missions, tracks, tacviews, logs),
+so big folders can be listed, sorted, filtered and paginated without scanning them and rendering
+all their files every time.
+Watched folders are kept up to date as files are created, modified or deleted (with native file
+system notifications if the optional watchdog package is installed, or by polling them if not),
+and the UI is notified when files appear or disappear.
+It can also stream a zip archive of some of the files in a folder, as it's generated.
+It is meant to be used as a singleton, like this:
+
+from dsm import files
+files.watch({"dcs-tracks": (tracks_path, "*.trk")})
+page = files.list_files(folder_path, "*.trk", sort="date", page=2)
+print(page.files, page.pages)
+for data in files.stream_zip(tracks_path, ["a.trk", "b.trk"]):
+    ...
+"""
+from collections import namedtuple
+from datetime import datetime
+from fnmatch import fnmatch
+from logging import getLogger
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+import math
+import os
+import threading
+import time
+
+from dsm import events
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+logger = getLogger(__name__)
+
+
+FileInfo = namedtuple("FileInfo", "name size modified_at type")
+FilesPage = namedtuple("FilesPage", "files total page pages sort descending filter_text")
+# the index of a folder, and when it was last scanned
+FolderIndex = namedtuple("FolderIndex", "files folder_modified_at scanned_at")
+
+PAGE_SIZE = 50
+# changes in the size or date of files don't change the folder modification date (only adding,
+# deleting or renaming do), so folders are scanned again after this time anyway
+RESCAN_EVERY_SECONDS = 30
+# watched folders are kept up to date, but just in case some notification was missed, they are
+# also scanned again after this time
+RESCAN_WATCHED_EVERY_SECONDS = 600
+# how often watched folders are polled (if there are no native notifications) and changes are
+# pushed to the UI
+CHECK_WATCHED_EVERY_SECONDS = 2
+
+# files that are already compressed are stored as they are in zip archives, compressing them
+# again would only waste cpu
+ZIP_STORED_SUFFIXES = {".acmi", ".miz", ".trk", ".zip", ".gz"}
+ZIP_CHUNK_BYTES = 1024 * 1024
+
+SORT_KEYS = {
+    "name": lambda file_info: file_info.name.lower(),
+    "date": lambda file_info: file_info.modified_at,
+    "size": lambda file_info: file_info.size,
+}
+
+# indexes by folder path
+indexes = {}
+indexes_lock = threading.Lock()
+
+# watched folders: {folder path: (name in the UI, glob filter of the files shown)}
+watched = {}
+# the watchdog observer, if watchdog is installed and watching
+observer = None
+# watched folders with changes in their list of files, that must be pushed to the UI
+changed_folders = set()
+
+
+def scan(folder_path):
+    """
+    Scan a folder and build the index of its files. Uses scandir, which on Windows gets the size
+    and dates of the files without having to ask for each file.
+    """
+    files = {}
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = FileInfo(
+                    name=entry.name,
+                    size=stat.st_size,
+                    modified_at=datetime.fromtimestamp(stat.st_mtime),
+                    type=Path(entry.name).suffix.lower().lstrip("."),
+                )
+
+    return files
+
+
+def get_index(folder_path):
+    """
+    Get the index of the files in a folder, scanning it only if it changed or the index is old.
+    """
+    folder_path = Path(folder_path)
+    folder_modified_at = folder_path.stat().st_mtime
+
+    with indexes_lock:
+        index = indexes.get(folder_path)
+
+    if folder_path in watched and observer is not None:
+        # kept up to date by the notifications, the folder date isn't useful
+        needs_scan = (index is None
+                      or time.monotonic() - index.scanned_at > RESCAN_WATCHED_EVERY_SECONDS)
+    else:
+        needs_scan = (index is None
+                      or index.folder_modified_at != folder_modified_at
+                      or time.monotonic() - index.scanned_at > RESCAN_EVERY_SECONDS)
+
+    if needs_scan:
+        index = FolderIndex(
+            files=scan(folder_path),
+            folder_modified_at=folder_modified_at,
+            scanned_at=time.monotonic(),
+        )
+        with indexes_lock:
+            indexes[folder_path] = index
+
+    return index
+
+
+def update(folder_path, file_name):
+    """
+    Update a single file in the index of its folder (added, modified or deleted), if the folder
+    was already indexed.
+    """
+    folder_path = Path(folder_path)
+    file_path = folder_path / file_name
+
+    with indexes_lock:
+        index = indexes.get(folder_path)
+        if index is None:
+            return
+
+        if folder_path in watched and matches_filter(file_name, watched[folder_path][1]):
+            is_new = file_name not in index.files
+            if file_path.is_file() == is_new:
+                changed_folders.add(folder_path)
+
+        if file_path.is_file():
+            stat = file_path.stat()
+            index.files[file_name] = FileInfo(
+                name=file_name,
+                size=stat.st_size,
+                modified_at=datetime.fromtimestamp(stat.st_mtime),
+                type=file_path.suffix.lower().lstrip("."),
+            )
+        else:
+            index.files.pop(file_name, None)
+
+        # the folder changed because of this file, no need to scan it again
+        indexes[folder_path] = index._replace(folder_modified_at=folder_path.stat().st_mtime)
+
+
+def forget(folder_path):
+    """
+    Forget the index of a folder, so it's scanned again the next time it's needed.
+    """
+    with indexes_lock:
+        indexes.pop(Path(folder_path), None)
+
+
+def matches_filter(file_name, glob_filter):
+    """
+    Check if a file name matches a glob filter, or any of them if it's a tuple of filters.
+    """
+    if isinstance(glob_filter, str):
+        return fnmatch(file_name, glob_filter)
+    return any(fnmatch(file_name, single_filter) for single_filter in glob_filter)
+
+
+def list_files(folder_path, glob_filter, sort="date", descending=True, filter_text="", page=1,
+               page_size=PAGE_SIZE, matching_names=()):
+    """
+    List a page of the files in a folder that match the glob filter and contain the filter text
+    in their names (case insensitive), sorted by name, date or size.
+    Files in matching_names are considered to match the filter text too (for instance, because
+    their contents contain it).
+    """
+    if sort not in SORT_KEYS:
+        sort = "date"
+
+    index = get_index(folder_path)
+    with indexes_lock:
+        all_files = list(index.files.values())
+
+    matching_files = [
+        file_info
+        for file_info in all_files
+        if matches_filter(file_info.name, glob_filter)
+        and (filter_text.lower() in file_info.name.lower() or file_info.name in matching_names)
+    ]
+    matching_files.sort(key=SORT_KEYS[sort], reverse=descending)
+
+    pages = max(1, math.ceil(len(matching_files) / page_size))
+    page = min(max(1, page), pages)
+    page_start = (page - 1) * page_size
+
+    return FilesPage(
+        files=matching_files[page_start:page_start + page_size],
+        total=len(matching_files),
+        page=page,
+        pages=pages,
+        sort=sort,
+        descending=descending,
+        filter_text=filter_text,
+    )
+
+
+class WatchdogHandler(FileSystemEventHandler):
+    """
+    Applies the file system notifications of a watched folder to its index.
+    """
+    def __init__(self, folder_path):
+        super().__init__()
+        self.folder_path = folder_path
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path and Path(path).parent == self.folder_path:
+                try:
+                    update(self.folder_path, Path(path).name)
+                except OSError:
+                    # the file was deleted or the folder is gone while updating it, a later
+                    # notification or scan will fix the index
+                    pass
+
+
+def watch(folders):
+    """
+    Start watching the specified folders, {name in the UI: (folder path, glob filter)}, instead
+    of the ones watched until now.
+    """
+    global observer
+
+    if observer is not None:
+        observer.stop()
+        observer = None
+
+    with indexes_lock:
+        watched.clear()
+        for name, (folder_path, glob_filter) in folders.items():
+            watched[Path(folder_path)] = (name, glob_filter)
+
+    if Observer is None:
+        logger.debug("watchdog not installed, watched folders will be polled")
+        return
+
+    observer = Observer()
+    for folder_path in watched:
+        if folder_path.exists():
+            observer.schedule(WatchdogHandler(folder_path), str(folder_path), recursive=False)
+    observer.daemon = True
+    observer.start()
+
+
+def shown_names(files, glob_filter):
+    """
+    Get the names of the files that are shown in the UI, from a folder index.
+    """
+    return {file_name for file_name in files if matches_filter(file_name, glob_filter)}
+
+
+def check_watched():
+    """
+    Poll the watched folders for changes (if there are no native notifications), and let the UI
+    know about the folders whose lists of files changed.
+    """
+    with indexes_lock:
+        folders = dict(watched)
+
+    for folder_path, (name, glob_filter) in folders.items():
+        if not folder_path.exists():
+            continue
+
+        if observer is None:
+            with indexes_lock:
+                index = indexes.get(folder_path)
+            # files are only created, deleted or renamed if the folder date changed. And if the
+            # folder was never listed, there's no need to keep it up to date yet
+            folder_modified_at = folder_path.stat().st_mtime
+            if index is not None and index.folder_modified_at != folder_modified_at:
+                new_files = scan(folder_path)
+                with indexes_lock:
+                    if shown_names(index.files, glob_filter) != shown_names(new_files, glob_filter):
+                        changed_folders.add(folder_path)
+                    indexes[folder_path] = FolderIndex(
+                        files=new_files,
+                        folder_modified_at=folder_modified_at,
+                        scanned_at=time.monotonic(),
+                    )
+
+        with indexes_lock:
+            changed = folder_path in changed_folders
+            changed_folders.discard(folder_path)
+        if changed:
+            events.notify(trigger=f"files-changed-{name}")
+
+
+class ZipStream:
+    """
+    Minimal writable file, where a zip archive is written while it's being sent. It only keeps
+    what was written since the last time it was taken.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """
+        Take (and forget) everything written since the last time.
+        """
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(folder_path, file_names):
+    """
+    Generate a zip archive of the specified files in a folder, yielding its contents as it's
+    generated, without writing it to disk or keeping the files in memory. Files that no longer
+    exist are skipped.
+    """
+    folder_path = Path(folder_path)
+    stream = ZipStream()
+
+    with ZipFile(stream, "w") as zip_file:
+        for file_name in file_names:
+            file_path = folder_path / file_name
+            if not file_path.is_file():
+                continue
+
+            zip_info = ZipInfo.from_file(file_path, file_name)
+            if file_path.suffix.lower() in ZIP_STORED_SUFFIXES:
+                zip_info.compress_type = ZIP_STORED
+            else:
+                zip_info.compress_type = ZIP_DEFLATED
+
+            # files can still be growing (like the tacview of the current mission), only the size
+            # they had when we started is archived
+            remaining = zip_info.file_size
+            with open(file_path, "rb") as source, zip_file.open(zip_info, "w") as entry:
+                while remaining > 0:
+                    data = source.read(min(ZIP_CHUNK_BYTES, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    entry.write(data)
+                    yield stream.take()
+
+            yield stream.take()
+
+    yield stream.take()
@@ -2,11 +2,13 @@
 Jobs that run periodically to check the health of the servers, automatically restart them, etc.
 """
 import logging
+from datetime import datetime
 from functools import wraps
 
 from flask_apscheduler import APScheduler
 
-from dsm import config
+from dsm import catalog, cleanup, config, files, log_search, logs, metrics, processes
+from dsm.exceptions import ImproperlyConfigured
 
 
 # scheduler singleton, we won't need more than one
@@ -35,7 +37,9 @@ def schedule_jobs():
     Schedule all the periodic jobs into the APScheduler that runs inside the web app.
     """
     # to avoid a circular import
-    from dsm.web import SERVERS
+    from dsm import status
+    from dsm.web import (SERVERS, SLOW_FRAGMENTS_REFRESH_SECONDS, get_watched_folders,
+                         refresh_pushed_fragments)
 
     # if any jobs are already scheduled, remove them (useful when modifying the config)
     scheduler.pause()
@@ -43,7 +47,98 @@ def schedule_jobs():
         job.remove()
     scheduler.resume()
 
+    # the status snapshot is what the UI shows, so it keeps running even if jobs are disabled
+    scheduler.add_job(
+        func=status.refresh,
+        trigger="interval",
+        id="status_refresh",
+        seconds=status.REFRESH_EVERY_SECONDS,
+        next_run_time=datetime.now(),
+        coalesce=True,
+        misfire_grace_time=status.REFRESH_EVERY_SECONDS,
+    )
+
+    # the parts of the UI that need to read files to be rendered are refreshed more slowly
+    scheduler.add_job(
+        func=refresh_pushed_fragments,
+        trigger="interval",
+        id="web_refresh_slow_fragments",
+        seconds=SLOW_FRAGMENTS_REFRESH_SECONDS,
+        next_run_time=datetime.now(),
+        coalesce=True,
+        misfire_grace_time=SLOW_FRAGMENTS_REFRESH_SECONDS,
+    )
+
+    # the folders shown in the UI might have changed with the config
+    files.watch(get_watched_folders())
+    scheduler.add_job(
+        func=files.check_watched,
+        trigger="interval",
+        id="files_check_watched",
+        seconds=files.CHECK_WATCHED_EVERY_SECONDS,
+        coalesce=True,
+        misfire_grace_time=files.CHECK_WATCHED_EVERY_SECONDS,
+    )
+
+    # retention policies delete files, so they are disabled with the rest of the automations
+    scheduler.add_job(
+        func=make_toggleable(cleanup.enforce_retention),
+        trigger="interval",
+        id="cleanup_enforce_retention",
+        minutes=cleanup.ENFORCE_RETENTION_EVERY_MINUTES,
+        next_run_time=datetime.now(),
+        coalesce=True,
+        misfire_grace_time=60,
+    )
+
+    scheduler.add_job(
+        func=catalog.prune,
+        trigger="interval",
+        id="catalog_prune",
+        hours=1,
+        misfire_grace_time=60,
+    )
+
+    if config.current["DSM_SAVE_METRICS"]:
+        scheduler.add_job(
+            func=metrics.prune,
+            trigger="interval",
+            id="metrics_prune",
+            hours=1,
+            misfire_grace_time=60,
+        )
+
+    if config.current["DSM_SAVE_LOGS"]:
+        # archives are also deleted when logs are archived, but that might not happen for days
+        scheduler.add_job(
+            func=logs.delete_old_archives,
+            trigger="interval",
+            id="logs_delete_old_archives",
+            hours=1,
+            next_run_time=datetime.now(),
+            misfire_grace_time=60,
+        )
+
+        scheduler.add_job(
+            func=log_search.update,
+            trigger="interval",
+            id="log_search_update",
+            seconds=log_search.UPDATE_EVERY_SECONDS,
+            next_run_time=datetime.now(),
+            coalesce=True,
+            misfire_grace_time=log_search.UPDATE_EVERY_SECONDS,
+        )
+
     for server_name, server_module in SERVERS.items():
+        # resources sampling is just monitoring, so it keeps running even if jobs are disabled
+        scheduler.add_job(
+            func=skip_if_not_configured(server_module.sample_resources),
+            trigger="interval",
+            id=f"{server_name}_sample_resources",
+            seconds=processes.SAMPLE_EVERY_SECONDS,
+            misfire_grace_time=processes.SAMPLE_EVERY_SECONDS,
+        )
+
         check_every_seconds = config.current[f"{server_name.upper()}_CHECK_EVERY_SECONDS"]
         if check_every_seconds:
             scheduler.add_job(
@@ -78,6 +173,21 @@ def make_toggleable(f):
     return new_f
 
 
+def skip_if_not_configured(f):
+    """
+    Make a function do nothing when the configs it requires aren't set, instead of failing with
+    an error every time it runs (like sampling the resources of a server that isn't used).
+    """
+    @wraps(f)
+    def new_f(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except ImproperlyConfigured as err:
+            logger.debug("Skipping %s: %s", f.__name__, err)
+
+    return new_f
+
+
 def enable():
     """
     Enable all the jobs.
@@ -0,0 +1,406 @@
+"""
+Search through the current and archived DSM logs, using an index stored in a small SQLite
+database.
+The log files are split in blocks of lines, and the index keeps the time range of each block and
+the words (and levels) found in it. Searches only read the blocks that can contain matching lines.
+The index is updated incrementally by a job: only the lines appended since the last update are
+indexed. Searches only index what was logged since then if it's a little.
+It is meant to be used as a singleton, like this:
+
+from dsm import log_search
+log_search.update()
+print(log_search.search(words="non_responsive", level="WARNING"))
+"""
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+from logging import getLogger
+from pathlib import Path
+import re
+import sqlite3
+import threading
+
+from dsm import config, logs
+
+
+logger = getLogger(__name__)
+
+
+LogMatch = namedtuple("LogMatch", "file time level text")
+
+# lines are indexed in blocks of about this size
+BLOCK_BYTES = 8 * 1024
+# to detect if a file was replaced or emptied, we remember its first bytes
+HEAD_BYTES = 256
+MAX_TOKEN_LENGTH = 40
+MAX_RESULTS = 200
+# blocks read from a file at once while searching
+SEARCH_BATCH_BLOCKS = 64
+UPDATE_EVERY_SECONDS = 60
+# searches index what was logged since the last update if it's at most this, bigger backlogs (the
+# first time, a big archive...) are left to the update job
+CATCH_UP_MAX_BYTES = 256 * 1024
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+SERVERS = ("dcs", "srs")
+
+# lines of log records start with the time and the level, other lines (like tracebacks) are a
+# continuation of the previous record
+LINE_START_REGEX = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ ([A-Z]+) ")
+TOKEN_REGEX = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    head BLOB NOT NULL,
+    indexed_bytes INTEGER NOT NULL,
+    last_time INTEGER,
+    last_level TEXT
+);
+
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    first_time INTEGER,
+    last_time INTEGER,
+    first_level TEXT
+);
+CREATE INDEX IF NOT EXISTS blocks_by_file ON blocks (file_id);
+CREATE INDEX IF NOT EXISTS blocks_by_time ON blocks (last_time);
+
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    block_id INTEGER NOT NULL,
+    PRIMARY KEY (token, block_id)
+) WITHOUT ROWID;
+"""
+
+
+connection = None
+connection_lock = threading.Lock()
+# only one update at a time, updates can be long the first time a year of logs is indexed
+update_lock = threading.Lock()
+
+
+def get_path():
+    """
+    Get the path to the logs index database file.
+    """
+    config_path = Path(config.current_path)
+    return config_path.parent / "dsm_logs_index.db"
+
+
+def get_connection():
+    """
+    Get the connection to the logs index database, creating the database if needed.
+    The connection is shared between threads, so it must only be used while holding
+    connection_lock.
+    """
+    global connection
+
+    if connection is None:
+        connection = sqlite3.connect(get_path(), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+
+    return connection
+
+
+def get_log_files():
+    """
+    Get the current and archived log files, by name. Compressed archives are named as their
+    uncompressed versions, so compressing an archive doesn't require indexing it again.
+    """
+    log_files = {}
+    for path in [Path(logs.get_path())] + sorted(logs.get_archives(), key=lambda p: p.suffix):
+        # while an archive is being compressed both versions exist, the uncompressed one wins
+        name = path.name.removesuffix(".gz")
+        if path.exists() and name not in log_files:
+            log_files[name] = path
+
+    return log_files
+
+
+def tokenize(text):
+    """
+    Get the set of (lowercase) words in a text.
+    """
+    return {
+        token
+        for token in TOKEN_REGEX.findall(text.lower())
+        if len(token) <= MAX_TOKEN_LENGTH
+    }
+
+
+@lru_cache(maxsize=1024)
+def parse_time(time):
+    """
+    Convert the time of a log line to a timestamp. Times that are already timestamps (or None) are
+    returned as they are.
+    """
+    if isinstance(time, bytes):
+        return int(datetime.strptime(time.decode(), "%Y-%m-%d %H:%M:%S").timestamp())
+    return time
+
+
+def parse_lines(contents, time, level):
+    """
+    Parse the lines of a block of logs, yielding (line, time, level) for each one. Lines that
+    don't start a new log record (like tracebacks) get the time and level of the previous one.
+    Lines and times are returned as they are in the file (bytes), decoding and parsing them is left
+    to the caller (with parse_time), as it's only needed for some of them.
+    """
+    for line in contents.splitlines():
+        match = LINE_START_REGEX.match(line)
+        if match:
+            time = match.group(1)
+            level = match.group(2).decode()
+
+        yield line, time, level
+
+
+def update():
+    """
+    Update the index with the lines appended to the log files since the last update, and forget
+    the files that no longer exist.
+    Returns False if another update was already running, so this one did nothing.
+    """
+    if not update_lock.acquire(blocking=False):
+        return False
+
+    try:
+        log_files = get_log_files()
+
+        with connection_lock:
+            db = get_connection()
+            indexed_files = dict(db.execute("SELECT name, id FROM files"))
+
+            for name, file_id in indexed_files.items():
+                if name not in log_files:
+                    forget_file(db, file_id)
+            db.commit()
+
+        for name, path in log_files.items():
+            try:
+                index_file(name, path)
+            except OSError as err:
+                logger.warning("Failed to index log file %s: %s", path, err)
+
+        return True
+    finally:
+        update_lock.release()
+
+
+def get_unindexed_bytes():
+    """
+    Get how many bytes of the log files are not indexed yet.
+    """
+    with connection_lock:
+        indexed_bytes = dict(get_connection().execute("SELECT name, indexed_bytes FROM files"))
+
+    unindexed = 0
+    for name, path in get_log_files().items():
+        try:
+            unindexed += max(0, logs.get_size(path) - indexed_bytes.get(name, 0))
+        except OSError:
+            # archived or compressed just now
+            continue
+
+    return unindexed
+
+
+def forget_file(db, file_id):
+    """
+    Remove a file and its blocks from the index.
+    """
+    db.execute("DELETE FROM postings WHERE block_id IN (SELECT id FROM blocks WHERE file_id = ?)",
+               (file_id,))
+    db.execute("DELETE FROM blocks WHERE file_id = ?", (file_id,))
+    db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+
+def index_file(name, path):
+    """
+    Index the lines appended to a log file since the last time it was indexed. If the file was
+    replaced or emptied, it's indexed again from the beginning.
+    """
+    size = logs.get_size(path)
+    with logs.open_log(path) as log_file:
+        head = log_file.read(HEAD_BYTES)
+
+        with connection_lock:
+            db = get_connection()
+            row = db.execute(
+                "SELECT id, head, indexed_bytes, last_time, last_level FROM files WHERE name = ?",
+                (name,),
+            ).fetchone()
+
+            if row:
+                file_id, indexed_head, indexed_bytes, time, level = row
+                # the indexed head can be shorter, if the file was smaller at the time
+                if size < indexed_bytes or not head.startswith(indexed_head):
+                    logger.debug("Log file %s changed, indexing it again", name)
+                    forget_file(db, file_id)
+                    row = None
+                elif size == indexed_bytes:
+                    return
+
+            if row is None:
+                file_id = db.execute(
+                    "INSERT INTO files (name, head, indexed_bytes) VALUES (?, ?, 0)",
+                    (name, head),
+                ).lastrowid
+                indexed_bytes, time, level = 0, None, None
+            db.commit()
+
+        log_file.seek(indexed_bytes)
+        while True:
+            contents = log_file.read(BLOCK_BYTES)
+            # only complete lines are indexed, the rest is left for the next update (unless a
+            # single line is longer than a block)
+            last_line_end = contents.rfind(b"\n")
+            if last_line_end != -1:
+                contents = contents[:last_line_end + 1]
+            elif len(contents) < BLOCK_BYTES:
+                break
+
+            block_start = indexed_bytes
+            block_end = indexed_bytes + len(contents)
+            first_time, first_level = time, level
+            tokens = set()
+            for line, time, level in parse_lines(contents, time, level):
+                if first_time is None:
+                    first_time, first_level = time, level
+                tokens |= tokenize(line.decode("utf-8", errors="replace"))
+                tokens.add(f"level:{level}".lower())
+            first_time, time = parse_time(first_time), parse_time(time)
+
+            with connection_lock:
+                db = get_connection()
+                block_id = db.execute(
+                    "INSERT INTO blocks (file_id, start, end, first_time, last_time, first_level) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_id, block_start, block_end, first_time, time, first_level),
+                ).lastrowid
+                db.executemany(
+                    "INSERT OR IGNORE INTO postings (token, block_id) VALUES (?, ?)",
+                    ((token, block_id) for token in tokens),
+                )
+                db.execute(
+                    "UPDATE files SET head = ?, indexed_bytes = ?, last_time = ?, last_level = ? "
+                    "WHERE id = ?",
+                    (head, block_end, time, level, file_id),
+                )
+                db.commit()
+
+            indexed_bytes = block_end
+            log_file.seek(indexed_bytes)
+
+
+def batch_by_file(blocks):
+    """
+    Split a list of blocks in batches of consecutive blocks from the same file, of at most
+    SEARCH_BATCH_BLOCKS blocks. Yields (file name, batch).
+    """
+    for name, file_blocks in groupby(blocks, key=lambda block: block[0]):
+        file_blocks = list(file_blocks)
+        for i in range(0, len(file_blocks), SEARCH_BATCH_BLOCKS):
+            yield name, file_blocks[i:i + SEARCH_BATCH_BLOCKS]
+
+
+def search(words="", level=None, server=None, from_time=None, to_time=None,
+           max_results=MAX_RESULTS):
+    """
+    Search the log lines that contain all the specified words (case insensitive), from the
+    specified level, mentioning the specified server (dcs or srs), and in the specified time range
+    (datetimes). Returns a list of LogMatch, newest first.
+    Only the indexed lines can be found. If only a little was logged since the last update of the
+    index, it's indexed before searching, so the latest lines can be found too.
+    """
+    if get_unindexed_bytes() <= CATCH_UP_MAX_BYTES:
+        update()
+
+    tokens = tokenize(words)
+    if server:
+        tokens.add(server.lower())
+    required_tokens = set(tokens)
+    if level:
+        required_tokens.add(f"level:{level}".lower())
+
+    from_timestamp = int(from_time.timestamp()) if from_time else 0
+    to_timestamp = int(to_time.timestamp()) if to_time else 2 ** 62
+
+    query = """
+        SELECT files.name, blocks.start, blocks.end, blocks.first_time, blocks.first_level
+        FROM blocks
+        JOIN files ON files.id = blocks.file_id
+        WHERE coalesce(blocks.last_time, 0) >= ? AND coalesce(blocks.first_time, 0) <= ?
+    """
+    params = [from_timestamp, to_timestamp]
+    if required_tokens:
+        query += f"""
+            AND blocks.id IN (
+                SELECT block_id FROM postings
+                WHERE token IN ({", ".join("?" * len(required_tokens))})
+                GROUP BY block_id
+                HAVING count(*) = ?
+            )
+        """
+        params += list(required_tokens) + [len(required_tokens)]
+    query += " ORDER BY blocks.last_time DESC, blocks.start DESC"
+
+    with connection_lock:
+        candidate_blocks = get_connection().execute(query, params).fetchall()
+
+    # bytes are only lowercased in ascii, so other words are left to the check with the tokens of
+    # the decoded line
+    encoded_tokens = [token.encode() for token in tokens if token.isascii()]
+    log_files = get_log_files()
+    matches = []
+    for name, batch in batch_by_file(candidate_blocks):
+        if name not in log_files:
+            continue
+
+        # blocks are read in the order they are in the file, which is important for compressed
+        # files (seeking backwards means decompressing from the beginning again)
+        contents_by_start = {}
+        with logs.open_log(log_files[name]) as log_file:
+            for _, start, end, _, _ in sorted(batch, key=lambda block: block[1]):
+                log_file.seek(start)
+                contents_by_start[start] = log_file.read(end - start)
+
+        for _, start, _, first_time, first_level in batch:
+            block_matches = []
+            lines = parse_lines(contents_by_start[start], first_time, first_level)
+            for line, time, line_level in lines:
+                if level and line_level != level:
+                    continue
+                # quick check before tokenizing the line, most lines don't even contain the words
+                line_lower = line.lower()
+                if not all(token in line_lower for token in encoded_tokens):
+                    continue
+                time = parse_time(time)
+                if time is not None and not from_timestamp <= time <= to_timestamp:
+                    continue
+                line = line.decode("utf-8", errors="replace")
+                if not tokens <= tokenize(line):
+                    continue
+
+                block_matches.append(LogMatch(
+                    file=log_files[name].name,
+                    time=datetime.fromtimestamp(time) if time is not None else None,
+                    level=line_level,
+                    text=line,
+                ))
+
+            matches.extend(reversed(block_matches))
+
+        if len(matches) >= max_results:
+            break
+
+    return matches[:max_results]
@@ -1,13 +1,62 @@
 """
 Logging utilities.
 """
+import atexit
+import copy
+import gzip
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import shutil
-from datetime import datetime
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from enum import Enum
 from pathlib import Path
 
-from dsm import config
+from dsm import config, metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# a piece of the log file, with the byte offsets where it starts and ends, so the next or previous
+# pieces can be read later
+LogChunk = namedtuple("LogChunk", "text start end")
+
+TAIL_LINES = 500
+# when reading backwards from the end of the file, read blocks of this size
+TAIL_BLOCK_BYTES = 64 * 1024
+TAIL_MAX_BYTES = 4 * 1024 * 1024
+# max bytes to read at once when following the log file
+FOLLOW_MAX_BYTES = 1024 * 1024
+# if the log file can't be rotated (other program has it open, etc), wait this much before trying
+# again
+ROTATION_RETRY_SECONDS = 60
+
+# fields that can be passed to log calls (with extra={...}) to be saved with their types in the
+# structured logs
+EVENT_FIELDS = ("server", "status", "resources", "mission", "players", "action", "duration",
+                "latency")
+
+# records waiting to be written by the log writer thread
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500
+# the log size shown in the web UI is pushed after the logs are written, but at most this often
+LOG_SIZE_PUSH_EVERY_SECONDS = 2
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+log_writer = None
+# records that couldn't be queued because the queue was full
+dropped_records = 0
+dropped_records_lock = threading.Lock()
+
+# the handler writing to the log file, if logs are saved
+file_handler = None
+# archived log files waiting to be compressed by the compression worker
+to_compress = queue.Queue()
 
 
 def get_path():
@@ -22,32 +71,539 @@ def get_path():
     return log_path
 
 
+def get_structured_path():
+    """
+    Get the path to the structured (json lines) log file.
+    """
+    return Path(get_path()).with_suffix(".jsonl")
+
+
+def get_archive_path(log_path=None):
+    """
+    Get a new path for an archived log file, that isn't used by any other archive (compressed or
+    not). By default for the main log file, but another log file can be specified.
+    """
+    log_path = Path(log_path or get_path())
+    while True:
+        archive_date = datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_path = log_path.parent / f"{log_path.stem}_{archive_date}{log_path.suffix}"
+
+        if not archive_path.exists() and not compressed_path(archive_path).exists():
+            return archive_path
+
+        time.sleep(0.1)
+
+
+def get_archives(log_path=None):
+    """
+    Get the archived log files (compressed or not). By default for the main log file, but another
+    log file can be specified.
+    """
+    log_path = Path(log_path or get_path())
+    return [
+        path
+        for path in log_path.parent.glob(f"{log_path.stem}_*{log_path.suffix}*")
+        if path.suffix in (log_path.suffix, ".gz") and path.is_file()
+    ]
+
+
+def move_to_archive(log_path):
+    """
+    Move a log file to a new archive file, and queue it to be compressed.
+    Returns the archive path, or None if the log file couldn't be moved (usually some other
+    program reading it, on windows).
+    """
+    archive_path = get_archive_path(log_path)
+    try:
+        os.replace(log_path, archive_path)
+    except OSError:
+        return None
+
+    to_compress.put(archive_path)
+    return archive_path
+
+
+def get_day(log_path):
+    """
+    Get the day a log file was last written, or today if it's empty or doesn't exist.
+    """
+    log_path = Path(log_path)
+    if log_path.exists() and log_path.stat().st_size:
+        return date.fromtimestamp(log_path.stat().st_mtime)
+    return date.today()
+
+
+def compressed_path(path):
+    """
+    Get the path that a log file will have after being compressed.
+    """
+    return path.parent / f"{path.name}.gz"
+
+
+def open_log(path):
+    """
+    Open a log file (compressed or not) for reading, in binary mode.
+    """
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def get_size(path):
+    """
+    Get the size of the contents of a log file (compressed or not). For compressed files, this is
+    the size after decompressing them, read from the end of the gzip file (only valid up to 4 GB,
+    more than enough for our archived logs).
+    """
+    path = Path(path)
+    if path.suffix == ".gz":
+        with open(path, "rb") as gz_file:
+            gz_file.seek(-4, os.SEEK_END)
+            return int.from_bytes(gz_file.read(4), "little")
+    return path.stat().st_size
+
+
+class RotatingLogHandler(logging.FileHandler):
+    """
+    Log handler that moves the log file to a new archive file when it's too big or a new day
+    starts, and then keeps writing to a new log file. Archives are compressed in the background.
+    """
+    def __init__(self, path, max_bytes=None, daily=False):
+        super().__init__(path, encoding="utf-8")
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self.retry_rotation_at = 0
+        # the log file might be from a previous day, if DSM was restarted
+        self.current_day = get_day(path)
+
+    def _open(self):
+        stream = super()._open()
+        # the size of the file is counted while writing to it, as asking the stream for its
+        # position flushes it
+        self.file_bytes = os.path.getsize(self.baseFilename)
+        return stream
+
+    def should_rotate(self):
+        """
+        Check if the log file must be rotated before writing the next record.
+        """
+        if self.stream is None or time.monotonic() < self.retry_rotation_at:
+            return False
+        if self.max_bytes and self.file_bytes >= self.max_bytes:
+            return True
+        if self.daily and date.today() != self.current_day and self.file_bytes:
+            return True
+        return False
+
+    def rotate(self):
+        """
+        Move the current log file to a new archive file, queue it to be compressed, and start a
+        new log file.
+        Returns the archive path, or None if the log file couldn't be moved.
+        Must be called while holding the handler lock.
+        """
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        archive_path = move_to_archive(self.baseFilename)
+        if archive_path is None:
+            # we can't log the error here, as we are in the middle of logging something
+            self.retry_rotation_at = time.monotonic() + ROTATION_RETRY_SECONDS
+
+        self.current_day = date.today()
+        self.stream = self._open()
+
+        return archive_path
+
+    def emit(self, record):
+        try:
+            if self.should_rotate():
+                self.rotate()
+
+            # not flushed after each record, the log writer flushes after each batch of records
+            line = self.format(record) + self.terminator
+            self.stream.write(line)
+            self.file_bytes += len(line.encode("utf-8"))
+        except Exception:
+            self.handleError(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Log handler that just puts the records in the (bounded) log queue, to be written by the log
+    writer thread. If the queue is full, records are dropped and counted instead of waiting.
+    """
+    def prepare(self, record):
+        # the message is formatted now, because its arguments could change before the writer
+        # gets to it. Exceptions are formatted now too, as tracebacks keep references to
+        # everything in their frames
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global dropped_records
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # records are logged from many threads at the same time
+            with dropped_records_lock:
+                dropped_records += 1
+            metrics.increment("dsm_log_records_dropped_total")
+
+
+def push_log_size():
+    """
+    Push the new size of the log file to the web UI.
+    """
+    # to avoid a circular import
+    from dsm.web import refresh_pushed_fragments
+
+    try:
+        refresh_pushed_fragments(["log-size"])
+    except Exception:
+        # not logged, it would be written by this same thread and fail again on the next push
+        pass
+
+
+def write_logs(handlers):
+    """
+    Take the records from the log queue and pass them to the handlers, in batches, flushing the
+    handlers after each batch. Runs until it finds a None in the queue.
+    After the records are written, the new log size is pushed to the web UI, at most every few
+    seconds.
+    """
+    reported_drops = 0
+    size_pushed_at = None
+    size_push_pending = False
+
+    while True:
+        if size_push_pending:
+            wait = max(0, size_pushed_at + LOG_SIZE_PUSH_EVERY_SECONDS - time.monotonic())
+        else:
+            wait = None
+        try:
+            records = [log_queue.get(timeout=wait)]
+        except queue.Empty:
+            records = []
+        while records and records[-1] is not None and len(records) < LOG_BATCH_SIZE:
+            try:
+                records.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for record in records:
+            if record is None:
+                break
+            for handler in handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+        for handler in handlers:
+            handler.flush()
+
+        if records and records[-1] is None:
+            return
+
+        size_push_pending = size_push_pending or bool(records)
+        if size_push_pending and (size_pushed_at is None or time.monotonic() - size_pushed_at
+                                  >= LOG_SIZE_PUSH_EVERY_SECONDS):
+            push_log_size()
+            size_pushed_at = time.monotonic()
+            size_push_pending = False
+
+        if dropped_records > reported_drops:
+            # written directly, queueing it could mean dropping it too
+            record = logger.makeRecord(
+                logger.name, logging.WARNING, __file__, 0,
+                "%s log records were dropped, logging couldn't keep up",
+                (dropped_records - reported_drops,), None,
+            )
+            reported_drops = dropped_records
+            for handler in handlers:
+                handler.handle(record)
+
+
+def stop_log_writer():
+    """
+    Stop the log writer thread, after it writes the records left in the queue.
+    """
+    log_queue.put(None)
+    log_writer.join(timeout=5)
+
+
+def as_json_value(value):
+    """
+    Convert a value passed in a log event field to something that can be saved as json, keeping
+    the structure of namedtuples and the names of enums.
+    """
+    if hasattr(value, "_asdict"):
+        return {key: as_json_value(item) for key, item in value._asdict().items()}
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [as_json_value(item) for item in value]
+    return value
+
+
+class JSONLinesHandler(logging.Handler):
+    """
+    Log handler that writes each record as a json object in its own line, including the typed
+    fields of the event (EVENT_FIELDS) passed with extra={...}.
+    Records are buffered and written in batches when the log writer flushes the handler after
+    each batch. Like the main log file, the file is archived when it's too big or a new day
+    starts.
+    """
+    def __init__(self, path, max_bytes=None, daily=False):
+        super().__init__()
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self.current_day = get_day(path)
+        # (record, json line) waiting to be written
+        self.buffer = []
+
+    def as_json(self, record):
+        """
+        Convert a log record to a json line.
+        """
+        event = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in EVENT_FIELDS:
+            if hasattr(record, field):
+                event[field] = as_json_value(getattr(record, field))
+        if record.exc_text:
+            event["exception"] = record.exc_text
+
+        return json.dumps(event, default=str)
+
+    def emit(self, record):
+        try:
+            line = self.as_json(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        # emit is called holding the handler lock, the same one used while flushing
+        self.buffer.append((record, line))
+
+    def flush(self):
+        """
+        Write the buffered records to the file.
+        """
+        with self.lock:
+            buffered, self.buffer = self.buffer, []
+            if not buffered:
+                return
+
+            try:
+                if self.path.exists():
+                    too_big = self.max_bytes and self.path.stat().st_size >= self.max_bytes
+                    new_day = self.daily and date.today() != self.current_day
+                    if too_big or new_day:
+                        move_to_archive(self.path)
+                        self.current_day = date.today()
+
+                with open(self.path, "a", encoding="utf-8") as structured_file:
+                    structured_file.write("\n".join(line for _, line in buffered) + "\n")
+            except Exception:
+                # can't be logged, as logging it would try to write again
+                last_record, _ = buffered[-1]
+                self.handleError(last_record)
+
+
+def compress(path):
+    """
+    Compress an archived log file with gzip, and delete the uncompressed version.
+    """
+    gz_path = compressed_path(path)
+    # compress to a temporary file first, so an interrupted compression never leaves a broken
+    # archive
+    temp_path = path.parent / f"{path.stem}.gz.tmp"
+    with open(path, "rb") as log_file, gzip.open(temp_path, "wb") as gz_file:
+        shutil.copyfileobj(log_file, gz_file, 1024 * 1024)
+    # keep the modification time, the retention policy is based on it
+    shutil.copystat(path, temp_path)
+    os.replace(temp_path, gz_path)
+    path.unlink()
+
+    return gz_path
+
+
+def delete_old_archives():
+    """
+    Delete the archived log files older than the configured retention.
+    """
+    keep_days = config.current["DSM_LOG_KEEP_DAYS"]
+    if not keep_days:
+        return
+
+    oldest_allowed = (datetime.now() - timedelta(days=keep_days)).timestamp()
+    for path in get_archives() + get_archives(get_structured_path()):
+        # a file that can't be deleted now (on windows, if it's being downloaded or searched) is
+        # deleted the next time
+        try:
+            if path.stat().st_mtime < oldest_allowed:
+                logger.info("Deleting old archived log file %s", path)
+                path.unlink()
+        except OSError as err:
+            logger.warning("Failed to delete old archived log file %s: %s", path, err)
+
+
+def compression_worker():
+    """
+    Compress the archived log files as they are queued, and apply the retention policy, in the
+    background so logging is never blocked by it. The retention policy is also applied
+    periodically by a job, for when no logs are archived for a while.
+    """
+    while True:
+        path = to_compress.get()
+        try:
+            if path.exists():
+                gz_path = compress(path)
+                logger.info("Log file archived and compressed to %s", gz_path)
+        except Exception as err:
+            logger.warning("Failed to compress archived log file %s: %s", path, err)
+
+        try:
+            delete_old_archives()
+        except Exception as err:
+            logger.warning("Failed to delete old archived log files: %s", err)
+
+
 def setup():
     """
     Set up logging for the application.
     """
+    global file_handler
+    global log_writer
+
     debug = os.environ.get("DEBUG", False)
     handlers = [logging.StreamHandler()]
 
     if config.current["DSM_SAVE_LOGS"]:
-        handlers.append(logging.FileHandler(get_path(), encoding="utf-8"))
+        rotate_at_mb = config.current["DSM_LOG_ROTATE_AT_MB"]
+        file_handler = RotatingLogHandler(
+            get_path(),
+            max_bytes=rotate_at_mb * 1024 * 1024 if rotate_at_mb else None,
+            daily=config.current["DSM_LOG_ROTATE_DAILY"],
+        )
+        handlers.append(file_handler)
+
+        if config.current["DSM_SAVE_STRUCTURED_LOGS"]:
+            handlers.append(JSONLinesHandler(
+                get_structured_path(),
+                max_bytes=rotate_at_mb * 1024 * 1024 if rotate_at_mb else None,
+                daily=config.current["DSM_LOG_ROTATE_DAILY"],
+            ))
+
+    # archives left uncompressed (older versions of DSM, or DSM closed while compressing)
+    for path in get_archives() + get_archives(get_structured_path()):
+        if path.suffix != ".gz":
+            to_compress.put(path)
+    threading.Thread(target=compression_worker, daemon=True).start()
+
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # the handlers are only used by the log writer thread, all the other threads just queue the
+    # records, so they never wait for the disk
+    log_writer = threading.Thread(target=write_logs, args=(handlers,), daemon=True)
+    log_writer.start()
+    atexit.register(stop_log_writer)
 
     logging.basicConfig(
         level=logging.DEBUG if debug else logging.INFO,
-        handlers=handlers,
-        format="%(asctime)s %(levelname)s %(message)s",
-        encoding="utf-8",
+        handlers=[DroppingQueueHandler(log_queue)],
     )
 
 
-def read_contents():
+def read_tail(lines=TAIL_LINES, before=None):
     """
-    Read the contents of the current log file.
+    Read the last lines of the current log file, without reading the whole file. If "before" is
+    specified (a byte offset), read the last lines before that offset instead of the end of the
+    file, which allows paging backwards through the logs.
     If no file is found, return None.
     """
     log_path = get_path()
-    if log_path.exists():
-        return log_path.read_text(encoding="utf-8")
+    if not log_path.exists():
+        return None
+
+    with open(log_path, "rb") as log_file:
+        end = log_file.seek(0, os.SEEK_END)
+        if before is not None:
+            end = max(0, min(before, end))
+
+        # read blocks backwards from the end until we have enough lines, reach the beginning of
+        # the file, or read too much (absurdly long lines)
+        start = end
+        blocks = []
+        newlines = 0
+        while start > 0 and newlines <= lines and end - start < TAIL_MAX_BYTES:
+            block_start = max(0, start - TAIL_BLOCK_BYTES)
+            log_file.seek(block_start)
+            blocks.insert(0, log_file.read(start - block_start))
+            newlines += blocks[0].count(b"\n")
+            start = block_start
+
+    contents = b"".join(blocks)
+
+    # keep only the requested lines. The first line is partial if we didn't read from the
+    # beginning of the file, so it's not considered
+    cut = len(contents) - 1 if contents.endswith(b"\n") else len(contents)
+    for _ in range(lines):
+        cut = contents.rfind(b"\n", 0, cut)
+        if cut == -1:
+            break
+    if cut != -1 or start > 0:
+        cut += 1
+        contents = contents[cut:]
+        start += cut
+
+    return LogChunk(contents.decode("utf-8", errors="replace"), start, end)
+
+
+def read_from(offset, max_bytes=FOLLOW_MAX_BYTES):
+    """
+    Read the complete lines appended to the current log file after the specified byte offset.
+    If the file was emptied or archived since (it's now smaller than the offset), read from the
+    beginning.
+    If no file is found, return None.
+    """
+    log_path = get_path()
+    if not log_path.exists():
+        return None
+
+    with open(log_path, "rb") as log_file:
+        size = log_file.seek(0, os.SEEK_END)
+        if offset > size:
+            offset = 0
+
+        log_file.seek(offset)
+        contents = log_file.read(min(size - offset, max_bytes))
+
+    # partial lines are left for the next read, unless a single line is longer than max_bytes
+    last_line_end = contents.rfind(b"\n")
+    if last_line_end != -1:
+        contents = contents[:last_line_end + 1]
+    elif len(contents) < max_bytes:
+        contents = b""
+
+    return LogChunk(contents.decode("utf-8", errors="replace"), offset, offset + len(contents))
 
 
 def clear():
@@ -56,29 +612,35 @@ def clear():
     """
     log_path = get_path()
     if log_path.exists():
-        log_path.write_text("")
+        if file_handler is None:
+            log_path.write_text("")
+        else:
+            with file_handler.lock:
+                # flushed first, or the buffered lines would be written after emptying it
+                file_handler.flush()
+                log_path.write_text("")
+                file_handler.file_bytes = 0
 
 
 def archive():
     """
-    Archive the current log contents into a new file, and clean the current log file.
+    Archive the current log contents into a new file (compressed in the background), and start a
+    new clean log file.
     If successful, returns the path to the archived log file.
     If the current log file does not exist, returns None.
     """
     log_path = get_path()
     if log_path.exists():
-        while True:
-            # create a new archive name, but make sure it doesn't exist
-            archive_date = datetime.now().strftime("%Y%m%d_%H%M%S")
-            archive_path = log_path.parent / log_path.name.replace(".log", f"_{archive_date}.log")
-
-            if not archive_path.exists():
-                break
-
-        # can't just move the current file because that breaks the logging handles, so we must
-        # copy to a new file and clean the current one instead
-        shutil.copy(log_path, archive_path)
-        clear()
+        if file_handler is None:
+            # nobody is writing to the file, we can just move it
+            archive_path = get_archive_path()
+            os.replace(log_path, archive_path)
+            to_compress.put(archive_path)
+        else:
+            with file_handler.lock:
+                archive_path = file_handler.rotate()
+            if archive_path is None:
+                raise RuntimeError("The log file is being used by another program")
 
         return archive_path
 
@@ -0,0 +1,162 @@
+"""
+Minimal parser of the Lua tables that DCS serializes in its files (missions, tracks, options...).
+It only understands what those files contain: assignments of literal values (tables, strings,
+numbers, booleans and nil) to global names. No expressions, functions, etc.
+Tables are returned as dicts, with the keys as they are in Lua (so arrays have keys 1, 2, 3...).
+
+from dsm import lua
+values = lua.parse_assignments('mission = { ["theatre"] = "Caucasus", [1] = true }')
+print(values["mission"]["theatre"])
+"""
+import re
+
+
+class LuaError(Exception):
+    """
+    The text is not the kind of Lua that this parser understands.
+    """
+
+
+# spaces are skipped, and each match is a single token. Numbers and names are matched together
+# (and told apart later) as that's much faster, which matters for missions of many MB
+TOKEN_REGEX = re.compile(r"""\s*(
+    \[(=*)\[.*?\]\2\]
+    | [{}\[\]=,;]
+    | "[^"\\]*(?:\\.[^"\\]*)*"
+    | --\[(=*)\[.*?\]\3\] | --[^\n]*
+    | [\w.+-]+
+    | '[^'\\]*(?:\\.[^'\\]*)*'
+)""", re.VERBOSE | re.DOTALL)
+NUMBER_REGEX = re.compile(r"-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)")
+NAME_REGEX = re.compile(r"[A-Za-z_]\w*")
+
+ESCAPE_REGEX = re.compile(r"\\(\d{1,3}|x[0-9a-fA-F]{2}|\n|.)", re.DOTALL)
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "a": "\a", "b": "\b", "f": "\f", "v": "\v",
+           "\n": "\n"}
+
+CONSTANTS = {"true": True, "false": False, "nil": None}
+
+
+def unescape(match):
+    """
+    Replace a single escape sequence of a Lua string.
+    """
+    escape = match.group(1)
+    if escape.isdigit():
+        return chr(int(escape))
+    elif escape.startswith("x") and len(escape) == 3:
+        return chr(int(escape[1:], 16))
+    return ESCAPES.get(escape, escape)
+
+
+def tokenize(text):
+    """
+    Split Lua text in tokens, skipping spaces and comments.
+    """
+    position = 0
+    for match in TOKEN_REGEX.finditer(text):
+        if match.start() != position:
+            break
+        position = match.end()
+
+        token = match.group(1)
+        if not token.startswith("--"):
+            yield token
+
+    if text[position:].strip():
+        raise LuaError(f"Unexpected text at position {position}: "
+                       f"{text[position:position + 20].strip()!r}")
+
+
+def next_token(tokens):
+    """
+    Get the next token, failing if the text ended.
+    """
+    try:
+        return next(tokens)
+    except StopIteration:
+        raise LuaError("Unexpected end of text") from None
+
+
+def parse_value(tokens, token):
+    """
+    Parse the value that starts with the specified token.
+    """
+    first = token[0]
+    if first == '"' or first == "'":
+        text = token[1:-1]
+        return ESCAPE_REGEX.sub(unescape, text) if "\\" in text else text
+    elif first == "{":
+        return parse_table(tokens)
+    elif first == "[" and len(token) > 1:
+        level = token.index("[", 1) + 1
+        contents = token[level:-level]
+        # a newline right after the opening brackets is ignored
+        return contents[1:] if contents.startswith("\n") else contents
+    elif token in CONSTANTS:
+        return CONSTANTS[token]
+    elif NUMBER_REGEX.fullmatch(token):
+        if "x" in token or "X" in token:
+            return int(token, 16)
+        try:
+            return int(token)
+        except ValueError:
+            return float(token)
+
+    raise LuaError(f"Unexpected {token!r}")
+
+
+def parse_table(tokens):
+    """
+    Parse the contents of a table, after its opening brace.
+    """
+    table = {}
+    next_index = 1
+
+    token = next_token(tokens)
+    while token != "}":
+        if token == "[":
+            key = parse_value(tokens, next_token(tokens))
+            if next_token(tokens) != "]" or next_token(tokens) != "=":
+                raise LuaError(f"Expected '] =' after key {key!r}")
+            table[key] = parse_value(tokens, next_token(tokens))
+        elif token not in CONSTANTS and NAME_REGEX.fullmatch(token):
+            if next_token(tokens) != "=":
+                raise LuaError(f"Expected '=' after {token!r}")
+            table[token] = parse_value(tokens, next_token(tokens))
+        else:
+            table[next_index] = parse_value(tokens, token)
+            next_index += 1
+
+        token = next_token(tokens)
+        if token == "," or token == ";":
+            token = next_token(tokens)
+        elif token != "}":
+            raise LuaError(f"Expected ',' or '}}', found {token!r}")
+
+    return table
+
+
+def parse_assignments(text):
+    """
+    Parse the global assignments in a Lua text (like 'mission = {...}'), returning a dict with the
+    value of each global name.
+    """
+    values = {}
+    tokens = tokenize(text)
+    for name in tokens:
+        if not NAME_REGEX.fullmatch(name) or next_token(tokens) != "=":
+            raise LuaError(f"Expected an assignment, found {name!r}")
+        values[name] = parse_value(tokens, next_token(tokens))
+
+    return values
+
+
+def as_list(table):
+    """
+    Get the values of a Lua array (a table with keys 1, 2, 3...) as a list. Empty tables and None
+    are empty lists.
+    """
+    if not table:
+        return []
+    return [table[key] for key in sorted(key for key in table if isinstance(key, int))]
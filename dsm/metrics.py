@@ -0,0 +1,418 @@
+"""
+History of the status and resources usage of the servers, stored in a small SQLite database.
+Every status snapshot is recorded as a sample, and samples are also aggregated into 1 minute and
+1 hour buckets (rollups) as they are recorded, so long periods of time can be queried fast and old
+raw samples can be deleted without losing the history.
+It also keeps some counters, gauges and histograms about DSM itself in memory, which are exposed
+together with the latest status in the Prometheus text format, so DSM can be scraped.
+It is meant to be used as a singleton, like this:
+
+from dsm import metrics
+metrics.record(status.current)
+metrics.prune()
+metrics.increment("dsm_server_starts_total", server="dcs")
+print(metrics.render_prometheus(status.current))
+"""
+from datetime import datetime, timedelta
+from logging import getLogger
+from pathlib import Path
+import sqlite3
+import threading
+
+from dsm import config
+
+
+logger = getLogger(__name__)
+
+
+# numeric values recorded in each sample, aggregated with min/avg/max in the rollups
+VALUES = ("memory", "cpu", "threads", "subprocs", "players", "latency")
+
+# rollup bucket sizes (in seconds), and for how long to keep the raw samples and each rollup
+RESOLUTIONS = (60, 3600)
+RETENTION = {
+    None: timedelta(days=7),  # raw samples
+    60: timedelta(days=90),
+    3600: timedelta(days=365 * 5),
+}
+
+# when querying the history without specifying a step, it's chosen to return at most this many
+# buckets
+MAX_HISTORY_POINTS = 300
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS samples (
+    time INTEGER NOT NULL,
+    server TEXT NOT NULL,
+    status TEXT,
+    mission TEXT,
+    memory REAL,
+    cpu REAL,
+    threads INTEGER,
+    subprocs INTEGER,
+    players INTEGER,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS samples_by_server_and_time ON samples (server, time);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    server TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    status TEXT,
+    mission TEXT,
+    {", ".join(f"{value}_min REAL, {value}_max REAL, {value}_sum REAL, {value}_count INTEGER"
+               for value in VALUES)},
+    PRIMARY KEY (resolution, server, bucket)
+) WITHOUT ROWID;
+"""
+
+# a new sample either creates its bucket, or updates its aggregated values. Null values (like cpu
+# when the server isn't running) are ignored by the aggregations
+ROLLUP_UPSERT = f"""
+INSERT INTO rollups (
+    resolution, server, bucket, samples, status, mission,
+    {", ".join(f"{value}_min, {value}_max, {value}_sum, {value}_count" for value in VALUES)}
+)
+VALUES (
+    :resolution, :server, :bucket, 1, :status, :mission,
+    {", ".join(f":{value}, :{value}, :{value}, :{value} IS NOT NULL" for value in VALUES)}
+)
+ON CONFLICT (resolution, server, bucket) DO UPDATE SET
+    samples = samples + 1,
+    status = excluded.status,
+    mission = excluded.mission,
+    {", ".join(
+        f"{value}_min = min(coalesce({value}_min, excluded.{value}_min), "
+        f"coalesce(excluded.{value}_min, {value}_min)), "
+        f"{value}_max = max(coalesce({value}_max, excluded.{value}_max), "
+        f"coalesce(excluded.{value}_max, {value}_max)), "
+        f"{value}_sum = coalesce({value}_sum, 0) + coalesce(excluded.{value}_sum, 0), "
+        f"{value}_count = {value}_count + excluded.{value}_count"
+        for value in VALUES
+    )}
+"""
+
+
+connection = None
+connection_lock = threading.Lock()
+
+
+def get_path():
+    """
+    Get the path to the metrics database file.
+    """
+    config_path = Path(config.current_path)
+    return config_path.parent / "dsm_metrics.db"
+
+
+def get_connection():
+    """
+    Get the connection to the metrics database, creating the database if needed.
+    The connection is shared between threads, so it must only be used while holding
+    connection_lock.
+    """
+    global connection
+
+    if connection is None:
+        connection = sqlite3.connect(get_path(), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+
+    return connection
+
+
+def record(snapshot):
+    """
+    Record the servers status and resources from a status snapshot, as a new sample.
+    """
+    time = int(snapshot.taken_at.timestamp())
+
+    samples = []
+    for server_name, server_snapshot in snapshot.servers.items():
+        resources = server_snapshot.resources
+        mission = server_snapshot.mission
+
+        samples.append({
+            "time": time,
+            "server": server_name,
+            "status": server_snapshot.status.name if server_snapshot.status else None,
+            "mission": mission.mission if mission else None,
+            "memory": resources.memory if resources else None,
+            "cpu": resources.cpu if resources else None,
+            "threads": resources.threads if resources else None,
+            "subprocs": resources.child_processes if resources else None,
+            "players": len(mission.players) if mission else None,
+            "latency": server_snapshot.latency,
+        })
+
+    with connection_lock:
+        db = get_connection()
+        with db:
+            db.executemany(
+                f"INSERT INTO samples (time, server, status, mission, {', '.join(VALUES)}) "
+                f"VALUES (:time, :server, :status, :mission, {', '.join(':' + v for v in VALUES)})",
+                samples,
+            )
+            for resolution in RESOLUTIONS:
+                db.executemany(ROLLUP_UPSERT, [
+                    dict(sample, resolution=resolution, bucket=time - time % resolution)
+                    for sample in samples
+                ])
+
+
+def prune():
+    """
+    Delete the raw samples and rollups that are older than their retention period.
+    """
+    now = datetime.now()
+
+    with connection_lock:
+        db = get_connection()
+        with db:
+            for resolution, retention in RETENTION.items():
+                oldest = int((now - retention).timestamp())
+                if resolution is None:
+                    db.execute("DELETE FROM samples WHERE time < ?", (oldest,))
+                else:
+                    db.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                               (resolution, oldest))
+
+    logger.debug("Old metrics pruned")
+
+
+def history(server_name, from_time, to_time, step=None):
+    """
+    Get the history of a server between two unix timestamps, aggregated in buckets of step
+    seconds, with the min, avg and max of each value in each bucket.
+    If no step is specified, one is chosen to return at most MAX_HISTORY_POINTS buckets.
+    Long steps are answered from the pre-aggregated rollups, so even long periods are fast to query.
+    """
+    if step is None:
+        step = max(1, -(-(to_time - from_time) // MAX_HISTORY_POINTS))
+
+    # use the biggest rollup that fits in the step, or the raw samples if none fits
+    resolution = max((r for r in RESOLUTIONS if r <= step), default=None)
+    if resolution:
+        # buckets must be made of whole rollups
+        step = -(-step // resolution) * resolution
+        columns = ", ".join(
+            f"min({value}_min), sum({value}_sum) / nullif(sum({value}_count), 0), max({value}_max)"
+            for value in VALUES
+        )
+        query = (
+            f"SELECT bucket - bucket % :step AS time, sum(samples), {columns} FROM rollups "
+            f"WHERE resolution = :resolution AND server = :server "
+            f"AND bucket >= :from_time AND bucket < :to_time "
+            f"GROUP BY 1 ORDER BY 1"
+        )
+    else:
+        columns = ", ".join(f"min({value}), avg({value}), max({value})" for value in VALUES)
+        query = (
+            f"SELECT time - time % :step AS time, count(*), {columns} FROM samples "
+            f"WHERE server = :server AND time >= :from_time AND time < :to_time "
+            f"GROUP BY 1 ORDER BY 1"
+        )
+
+    with connection_lock:
+        rows = get_connection().execute(query, {
+            "step": step,
+            "resolution": resolution,
+            "server": server_name,
+            "from_time": from_time,
+            "to_time": to_time,
+        }).fetchall()
+
+    series = []
+    for row in rows:
+        bucket = {"time": row[0], "samples": row[1]}
+        for i, value in enumerate(VALUES):
+            value_min, value_avg, value_max = row[2 + i * 3:5 + i * 3]
+            bucket[value] = {
+                "min": round(value_min, 1) if value_min is not None else None,
+                "avg": round(value_avg, 1) if value_avg is not None else None,
+                "max": round(value_max, 1) if value_max is not None else None,
+            }
+        series.append(bucket)
+
+    return {
+        "server": server_name,
+        "from": from_time,
+        "to": to_time,
+        "step": step,
+        "series": series,
+    }
+
+
+# counters, gauges and histograms about DSM itself, kept in memory and exposed (along with the
+# latest status snapshot) in the Prometheus text format
+INSTRUMENTS = {
+    "dsm_server_starts_total": ("counter", "Times a server was started by DSM."),
+    "dsm_server_restarts_total": ("counter", "Times a server was restarted by DSM."),
+    "dsm_dcs_hook_posts_total": ("counter", "Mission status updates posted by the DCS hook."),
+    "dsm_dcs_pending_actions": ("gauge", "Actions waiting to be delivered to the DCS server."),
+    "dsm_dcs_action_delivery_seconds": ("histogram", "Time from queuing an action until the DCS "
+                                                     "hook acknowledges it executed it."),
+    "dsm_log_records_dropped_total": ("counter", "Log records dropped because logging couldn't "
+                                                 "keep up."),
+    "dsm_http_request_duration_seconds": ("histogram", "Time spent answering web requests."),
+}
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+instruments_lock = threading.Lock()
+instrument_values = {}
+
+
+def labels_key(labels):
+    """
+    Convert some labels to something that can be used as part of a dict key.
+    """
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    """
+    Increment a counter.
+    """
+    with instruments_lock:
+        key = (name, labels_key(labels))
+        instrument_values[key] = instrument_values.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """
+    Set the current value of a gauge.
+    """
+    with instruments_lock:
+        instrument_values[(name, labels_key(labels))] = value
+
+
+def observe(name, value, **labels):
+    """
+    Add an observed value to a histogram.
+    """
+    with instruments_lock:
+        key = (name, labels_key(labels))
+        if key not in instrument_values:
+            # counts for each bucket, plus the sum and count of all the observed values
+            instrument_values[key] = [0] * len(HISTOGRAM_BUCKETS) + [0, 0]
+
+        histogram = instrument_values[key]
+        for i, bucket_limit in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bucket_limit:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def escape_label_value(value):
+    """
+    Escape a label value as required by the Prometheus text format.
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_sample(name, value, labels=()):
+    """
+    Format a single sample line in the Prometheus text format.
+    """
+    if labels:
+        labels_text = ",".join(
+            f'{label}="{escape_label_value(label_value)}"' for label, label_value in labels
+        )
+        name = f"{name}{{{labels_text}}}"
+
+    if value == float("inf"):
+        value = "+Inf"
+
+    return f"{name} {value}"
+
+
+def snapshot_samples(snapshot):
+    """
+    Get the samples to expose about the servers, from a status snapshot.
+    Returns a dict of {metric name: (type, help, [(labels, value), ...])}.
+    """
+    samples = {
+        "dsm_status_snapshot_age_seconds": ("gauge", "Age of the latest status snapshot.", []),
+        "dsm_server_status": ("gauge", "Current status of the server (1 for the current one).", []),
+        "dsm_server_memory_bytes": ("gauge", "Memory used by the server process.", []),
+        "dsm_server_cpu_percent": ("gauge", "CPU used by the server process and children.", []),
+        "dsm_server_threads": ("gauge", "Threads of the server process.", []),
+        "dsm_server_child_processes": ("gauge", "Child processes of the server process.", []),
+        "dsm_dcs_players": ("gauge", "Players connected to the DCS server.", []),
+        "dsm_dcs_responsiveness_latency_seconds": ("gauge", "Time the DCS server took to answer "
+                                                            "the latest responsiveness check.", []),
+    }
+
+    if snapshot is None:
+        return samples
+
+    age = (datetime.now() - snapshot.taken_at).total_seconds()
+    samples["dsm_status_snapshot_age_seconds"][2].append(((), round(age, 3)))
+
+    for server_name, server_snapshot in snapshot.servers.items():
+        server_label = (("server", server_name),)
+
+        if server_snapshot.status is not None:
+            for possible_status in type(server_snapshot.status):
+                samples["dsm_server_status"][2].append((
+                    server_label + (("status", possible_status.name),),
+                    int(possible_status == server_snapshot.status),
+                ))
+
+        resources = server_snapshot.resources
+        if resources:
+            samples["dsm_server_memory_bytes"][2].append(
+                (server_label, int(resources.memory * 1024 * 1024)))
+            if resources.cpu is not None:
+                samples["dsm_server_cpu_percent"][2].append((server_label, resources.cpu))
+            samples["dsm_server_threads"][2].append((server_label, resources.threads))
+            samples["dsm_server_child_processes"][2].append(
+                (server_label, resources.child_processes))
+
+        if server_snapshot.mission:
+            samples["dsm_dcs_players"][2].append(((), len(server_snapshot.mission.players)))
+
+        if server_snapshot.latency is not None:
+            samples["dsm_dcs_responsiveness_latency_seconds"][2].append(
+                ((), server_snapshot.latency / 1000))
+
+    return samples
+
+
+def render_prometheus(snapshot):
+    """
+    Render the current values of all the instruments, and the latest status snapshot, in the
+    Prometheus text format.
+    """
+    samples = snapshot_samples(snapshot)
+
+    with instruments_lock:
+        for name, (kind, help_text) in INSTRUMENTS.items():
+            samples[name] = (kind, help_text, [
+                (labels, value)
+                for (instrument_name, labels), value in instrument_values.items()
+                if instrument_name == name
+            ])
+
+    lines = []
+    for name, (kind, help_text, values) in samples.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+        for labels, value in values:
+            if kind == "histogram":
+                for bucket_limit, bucket_count in zip(HISTOGRAM_BUCKETS, value):
+                    lines.append(format_sample(f"{name}_bucket", bucket_count,
+                                               labels + (("le", bucket_limit),)))
+                lines.append(format_sample(f"{name}_sum", value[-2], labels))
+                lines.append(format_sample(f"{name}_count", value[-1], labels))
+            else:
+                lines.append(format_sample(name, value, labels))
+
+    return "\n".join(lines) + "\n"
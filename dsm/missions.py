@@ -0,0 +1,121 @@
+"""
+Extraction of the information of DCS missions (.miz files), to show it in the list of missions:
+theatre, date and time, weather, coalitions, units, required modules and description.
+A .miz file is a zip with the mission as a Lua table in its "mission" file, and the texts (like
+the description) in its "l10n/DEFAULT/dictionary" file.
+The information is kept in the catalog, so each mission is only parsed once:
+
+from dsm import catalog, missions
+infos = catalog.request_infos(missions.CATALOG_KIND, missions_path, page.files, "some-trigger")
+"""
+from collections import namedtuple
+from zipfile import ZipFile
+
+from dsm import catalog, lua
+
+
+MissionInfo = namedtuple(
+    "MissionInfo",
+    "name theatre date start_time weather coalitions units modules description",
+)
+
+COALITIONS = ("blue", "red", "neutrals")
+UNIT_CATEGORIES = ("plane", "helicopter", "vehicle", "ship", "static")
+# skills of the units that players can fly
+PLAYER_SKILLS = ("Client", "Player")
+MAX_DESCRIPTION_LENGTH = 2000
+
+
+def read_lua(miz, file_name):
+    """
+    Read and parse a Lua file inside a .miz, returning the value it assigns to the global with the
+    same name as the file (like 'mission' in the 'mission' file). None if the file doesn't exist.
+    """
+    try:
+        contents = miz.read(file_name)
+    except KeyError:
+        return None
+
+    values = lua.parse_assignments(contents.decode("utf-8", errors="replace"))
+    return values.get(file_name.rsplit("/", 1)[-1])
+
+
+def count_coalition(coalition):
+    """
+    Count the groups, units and player slots of a coalition of the mission.
+    """
+    counts = {"groups": 0, "units": 0, "slots": 0}
+    for country in lua.as_list((coalition or {}).get("country")):
+        for category in UNIT_CATEGORIES:
+            for group in lua.as_list((country.get(category) or {}).get("group")):
+                units = lua.as_list(group.get("units"))
+                counts["groups"] += 1
+                counts["units"] += len(units)
+                counts["slots"] += sum(unit.get("skill") in PLAYER_SKILLS for unit in units)
+
+    return counts
+
+
+def get_weather(weather):
+    """
+    Summarize the weather of the mission.
+    """
+    clouds = weather.get("clouds") or {}
+    wind = (weather.get("wind") or {}).get("atGround") or {}
+    return {
+        "temperature": (weather.get("season") or {}).get("temperature"),
+        "wind_speed": wind.get("speed"),
+        "wind_direction": wind.get("dir"),
+        "clouds": clouds.get("preset") or (f"density {clouds['density']}/10"
+                                           if clouds.get("density") else "clear"),
+        "fog": bool(weather.get("enable_fog")),
+        "visibility": (weather.get("visibility") or {}).get("distance"),
+    }
+
+
+def extract(path):
+    """
+    Extract the information of a mission file. Runs in the catalog extraction processes.
+    """
+    with ZipFile(path) as miz:
+        mission = read_lua(miz, "mission")
+        dictionary = read_lua(miz, "l10n/DEFAULT/dictionary") or {}
+
+    if not isinstance(mission, dict):
+        raise ValueError("The file doesn't contain a mission")
+
+    def translate(text):
+        # texts can be in the mission itself, or keys to find them in the dictionary
+        if isinstance(text, str) and text.startswith("DictKey_"):
+            return dictionary.get(text, "")
+        return text or ""
+
+    date = mission.get("date") or {}
+    start_time = int(mission.get("start_time") or 0)
+    coalitions = {
+        coalition_name: count_coalition((mission.get("coalition") or {}).get(coalition_name))
+        for coalition_name in COALITIONS
+    }
+
+    return MissionInfo(
+        name=translate(mission.get("sortie")),
+        theatre=mission.get("theatre"),
+        date=(f"{date['Year']:04}-{date['Month']:02}-{date['Day']:02}"
+              if {"Year", "Month", "Day"} <= date.keys() else None),
+        start_time=f"{start_time // 3600 % 24:02}:{start_time // 60 % 60:02}",
+        weather=get_weather(mission.get("weather") or {}),
+        coalitions=coalitions,
+        units=sum(counts["units"] for counts in coalitions.values()),
+        modules=sorted(set((mission.get("requiredModules") or {}).values())),
+        description=translate(mission.get("descriptionText"))[:MAX_DESCRIPTION_LENGTH],
+    )
+
+
+CATALOG_KIND = catalog.Kind(
+    name="mission",
+    extract=extract,
+    info_type=MissionInfo,
+    version=1,
+    template="mission_details.html",
+    search_fields=("name", "theatre", "modules", "description"),
+)
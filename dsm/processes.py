@@ -5,6 +5,7 @@ import logging
 import os
 import platform
 import subprocess
+import threading
 import time
 from collections import namedtuple
 from pathlib import Path
@@ -22,6 +23,20 @@ ProcessInfo = namedtuple("ProcessInfo", "pid name memory cpu threads child_proce
 ON_WINDOWS = platform.system() == "Windows"
 
 
+# processes already found, by exe name. Once found, a process is pinned and reused until it's gone,
+# so we don't need to scan the whole process table every time we need info about it
+tracked = {}
+tracked_lock = threading.Lock()
+
+# cpu usage can only be measured between two calls on the same process handle, so a background job
+# samples the tracked processes (and their children) every SAMPLE_EVERY_SECONDS, keeping long
+# lived handles, and the latest samples are served from here
+SAMPLE_EVERY_SECONDS = 5
+samples = {}
+sampled_handles = {}
+sample_lock = threading.Lock()
+
+
 def get_exe_name(exe_path):
     """
     Get the name of the exe from a path, to be used to find the process.
@@ -29,47 +44,166 @@ def get_exe_name(exe_path):
     return Path(exe_path).name
 
 
-def find(exe_name):
+def scan(exe_name):
     """
-    Find a process by its executable name, and return info about its current status.
+    Scan the whole process table looking for a process by its executable name.
+    Processes matching by name are preferred, and only if none is found we look into the command
+    lines too (reading command lines is way more expensive, specially on Windows).
     If the process is not found, return None.
     """
-    for proc in psutil.process_iter():
-        try:
-            full_name = proc.name() + "".join(proc.cmdline())
-            if exe_name.lower() in full_name.lower():
-                return ProcessInfo(
-                    pid=proc.pid,
-                    name=full_name,
-                    memory=round(proc.memory_info().rss / (1024 * 1024), 1),  # MB
-                    cpu=round(proc.cpu_percent(), 1),
-                    threads=proc.num_threads(),
-                    child_processes=len(proc.children()),
-                )
-        except Exception:
-            pass
+    exe_name = exe_name.lower()
+
+    for proc in psutil.process_iter(["name"]):
+        if exe_name in (proc.info["name"] or "").lower():
+            return proc
+
+    for proc in psutil.process_iter(["name", "cmdline"]):
+        full_name = (proc.info["name"] or "") + "".join(proc.info["cmdline"] or [])
+        if exe_name in full_name.lower():
+            return proc
 
     return None
 
 
+def is_alive(proc):
+    """
+    Check if a previously found process is still the same one and still running.
+    psutil validates the process identity using its create time, so a new process reusing the same
+    PID is not confused with the old one.
+    """
+    try:
+        return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
+def get_process(exe_name):
+    """
+    Get the psutil.Process running the executable with the given name.
+    The process table is scanned only the first time, or when the pinned process is gone. After
+    that, the same process handle is reused.
+    If the process is not found, return None.
+    """
+    with tracked_lock:
+        proc = tracked.get(exe_name)
+        if proc is not None and is_alive(proc):
+            return proc
+
+        proc = scan(exe_name)
+        if proc is None:
+            tracked.pop(exe_name, None)
+        else:
+            logger.debug("Tracking process %s with pid %s", exe_name, proc.pid)
+            tracked[exe_name] = proc
+
+        return proc
+
+
+def get_sampled_handle(proc):
+    """
+    Get the long lived handle used to sample the cpu usage of a process, and whether it was already
+    sampled before (otherwise, its first cpu measurement is meaningless).
+    """
+    handle = sampled_handles.get(proc.pid)
+    if handle is not None and handle == proc:
+        return handle, True
+
+    sampled_handles[proc.pid] = proc
+    return proc, False
+
+
+def sample(exe_name):
+    """
+    Take a new sample of the resources used by a process, and store it as its latest sample.
+    The cpu usage is measured since the previous sample, and includes the cpu used by its child
+    processes. It's None when there is no previous sample to compare with.
+    If the process is not found, return None.
+    """
+    with sample_lock:
+        proc = get_process(exe_name)
+        if proc is None:
+            samples.pop(exe_name, None)
+            return None
+
+        try:
+            with proc.oneshot():
+                children = proc.children()
+                memory = proc.memory_info().rss
+                threads = proc.num_threads()
+                name = proc.name() + "".join(proc.cmdline())
+
+            cpu = 0
+            complete = True
+            current_pids = set()
+            for measured_proc in [proc] + children:
+                try:
+                    handle, was_sampled = get_sampled_handle(measured_proc)
+                    current_pids.add(handle.pid)
+                    measured_cpu = handle.cpu_percent()
+                    if was_sampled:
+                        cpu += measured_cpu
+                    elif handle is proc:
+                        complete = False
+                except psutil.Error:
+                    # children can finish while we measure them, nothing to count then
+                    pass
+        except psutil.Error:
+            # the process died while we were reading its info
+            samples.pop(exe_name, None)
+            return None
+
+        # forget the handles of processes that are gone
+        for pid in list(sampled_handles):
+            if pid not in current_pids and not is_alive(sampled_handles[pid]):
+                del sampled_handles[pid]
+
+        info = ProcessInfo(
+            pid=proc.pid,
+            name=name,
+            memory=round(memory / (1024 * 1024), 1),  # MB
+            cpu=round(cpu, 1) if complete else None,
+            threads=threads,
+            child_processes=len(children),
+        )
+        samples[exe_name] = info
+        return info
+
+
+def find(exe_name):
+    """
+    Find a process by its executable name, and return info about its current status (from its
+    latest sample, so this doesn't need to wait for cpu measurements).
+    If the process is not found, return None.
+    """
+    proc = get_process(exe_name)
+    if proc is None:
+        return None
+
+    info = samples.get(exe_name)
+    if info is None or info.pid != proc.pid:
+        # never sampled yet, the cpu usage will be unknown until the next sample
+        info = sample(exe_name)
+
+    return info
+
+
 def stop(exe_name, kill=False):
     """
     Stop a process by its executable name, by default allowing it to gracefully shut down.
     If kill is True, it will forcefully kill the process instead.
     """
-    proc = find(exe_name)
+    proc = get_process(exe_name)
 
     if proc:
-        p = psutil.Process(proc.pid)
         if kill:
-            p.kill()
+            proc.kill()
         else:
             if ON_WINDOWS:
                 # on windows, p.terminate() is synonymous with kill(), so not a soft kill
                 # instead we use taskkill then
                 subprocess.run(f"taskkill /PID {exe_name} /T", shell=True, check=False)
             else:
-                p.terminate()
+                proc.terminate()
     else:
         # technically still a success, wasn't running anyway
         logger.debug("Process %s not found", exe_name)
@@ -84,7 +218,7 @@ def wait_until_stopped(exe_name, timeout=30):
     wait_start = time.monotonic()
 
     while True:
-        if find(exe_name):
+        if get_process(exe_name):
             if time.monotonic() - wait_start > timeout:
                 return False
         else:
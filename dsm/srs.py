@@ -13,8 +13,9 @@ same time.
 from logging import getLogger
 from enum import Enum
 from pathlib import Path
+import time
 
-from dsm import config, processes
+from dsm import config, metrics, processes
 
 
 logger = getLogger(__name__)
@@ -31,7 +32,7 @@ def current_status():
     exe_path = config.current["SRS_EXE_PATH"]
     exe_name = processes.get_exe_name(exe_path)
 
-    process = processes.find(exe_name)
+    process = processes.get_process(exe_name)
 
     if process:
         return SRSServerStatus.RUNNING
@@ -50,6 +51,17 @@ def current_resources():
     return processes.find(exe_name)
 
 
+@config.require("SRS_EXE_PATH")
+def sample_resources():
+    """
+    Take a new sample of the resources used by the SRS server, to be served by current_resources.
+    """
+    exe_path = config.current["SRS_EXE_PATH"]
+    exe_name = processes.get_exe_name(exe_path)
+
+    processes.sample(exe_name)
+
+
 @config.require("SRS_EXE_PATH")
 def start():
     """
@@ -59,8 +71,12 @@ def start():
     arguments = config.current["SRS_EXE_ARGUMENTS"]
 
     logger.info("Starting SRS server...")
+    start_time = time.monotonic()
     processes.start(exe_path, arguments)
-    logger.info("SRS server started")
+    metrics.increment("dsm_server_starts_total", server="srs")
+    logger.info("SRS server started", extra={
+        "server": "srs", "action": "start", "duration": time.monotonic() - start_time,
+    })
 
 
 @config.require("SRS_EXE_PATH")
@@ -72,8 +88,12 @@ def stop(kill=False):
     exe_name = processes.get_exe_name(exe_path)
 
     logger.info("Stopping the SRS server... (kill=%s)", kill)
+    stop_time = time.monotonic()
     processes.stop(exe_name, kill=kill)
-    logger.info("SRS server stop signal sent")
+    logger.info("SRS server stop signal sent", extra={
+        "server": "srs", "action": "kill" if kill else "stop",
+        "duration": time.monotonic() - stop_time,
+    })
 
 
 @config.require("SRS_EXE_PATH")
@@ -86,12 +106,16 @@ def restart():
     exe_name = processes.get_exe_name(exe_path)
 
     logger.info("Restarting SRS server...")
+    restart_time = time.monotonic()
+    metrics.increment("dsm_server_restarts_total", server="srs")
     stopped = processes.ensure_stopped(exe_name, stop_timeout=30, kill_timeout=5)
 
     if not stopped:
         raise RuntimeError("Failed to stop the SRS server, even after force killing it")
 
-    logger.info("SRS process stopped, starting again...")
+    logger.info("SRS process stopped, starting again...", extra={
+        "server": "srs", "action": "restart", "duration": time.monotonic() - restart_time,
+    })
     start()
 
 
@@ -108,14 +132,18 @@ def ensure_up():
     if resources:
         resources_bit = (
             f"ram:{resources.memory}MB "
-            f"cpu:{resources.cpu}% "
+            f"cpu:{'?' if resources.cpu is None else resources.cpu}% "
             f"threads:{resources.threads} "
             f"subprocs:{resources.child_processes}"
         )
     else:
         resources_bit = ""
 
-    logger.info("SRS server status: %s %s", status.name, resources_bit)
+    logger.info("SRS server status: %s %s", status.name, resources_bit, extra={
+        "server": "srs",
+        "status": status,
+        "resources": resources,
+    })
 
     try:
         if status == SRSServerStatus.NOT_RUNNING and restart_if_not_running:
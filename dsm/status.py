@@ -0,0 +1,85 @@
+"""
+This module keeps a snapshot of the status of everything DSM manages (servers, mission, jobs...).
+The snapshot is refreshed periodically by a background job, so the web UI can show it without
+having to check the servers on every request.
+It is meant to be used as a singleton, like this:
+
+from dsm import status
+status.refresh()
+print(status.current)
+
+This simplifies a lots of things, as we will never need to have multiple snapshots at the same
+time.
+"""
+from collections import namedtuple
+from datetime import datetime
+from logging import getLogger
+
+from dsm import config, dcs, jobs, metrics
+
+
+logger = getLogger(__name__)
+
+
+Snapshot = namedtuple("Snapshot", "taken_at servers jobs_enabled")
+ServerSnapshot = namedtuple("ServerSnapshot", "status resources mission latency error")
+
+
+REFRESH_EVERY_SECONDS = 3
+
+
+# latest snapshot, None until the first refresh finishes
+current = None
+
+
+def refresh():
+    """
+    Check the status of everything and replace the current snapshot with the results.
+    """
+    global current
+
+    # to avoid a circular import
+    from dsm.web import SERVERS, refresh_pushed_fragments
+
+    servers = {}
+    for server_name, module in SERVERS.items():
+        try:
+            servers[server_name] = ServerSnapshot(
+                status=module.current_status(),
+                resources=module.current_resources(),
+                mission=dcs.current_mission_status() if module is dcs else None,
+                latency=dcs.probe_latency if module is dcs else None,
+                error=None,
+            )
+        except Exception as err:
+            servers[server_name] = ServerSnapshot(
+                status=None,
+                resources=None,
+                mission=None,
+                latency=None,
+                error=str(err),
+            )
+
+    current = Snapshot(
+        taken_at=datetime.now(),
+        servers=servers,
+        jobs_enabled=jobs.enabled,
+    )
+    # the browsers are only notified if what they show changed
+    refresh_pushed_fragments(["status"])
+
+    if config.current["DSM_SAVE_METRICS"]:
+        try:
+            metrics.record(current)
+        except Exception as err:
+            logger.warning("Failed to save the status to the metrics history: %s", err)
+
+    return current
+
+
+def age():
+    """
+    Get the age of the current snapshot, in seconds. None if there is no snapshot yet.
+    """
+    if current:
+        return (datetime.now() - current.taken_at).total_seconds()
@@ -0,0 +1,188 @@
+"""
+Extraction of a summary of Tacview replays (.acmi files), to show it in the list of tacviews and
+to be able to search them: time span, objects, pilots and destroyed objects.
+Replays can be huge (GBs of text, usually zipped), so they are parsed as a stream, in blocks, and
+only the lines that matter for the summary are parsed (most lines are just position updates).
+The information is kept in the catalog, so each replay is only parsed once:
+
+from dsm import catalog, tacviews
+infos = catalog.request_infos(tacviews.CATALOG_KIND, tacviews_path, page.files, "some-trigger")
+"""
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from zipfile import ZipFile, is_zipfile
+import io
+import re
+
+from dsm import catalog
+
+
+TacviewInfo = namedtuple(
+    "TacviewInfo",
+    "title recorder start end duration objects pilots destroyed losses",
+)
+
+BLOCK_CHARS = 1024 * 1024
+MAX_PILOTS = 200
+MAX_DESTROYED = 200
+
+# the lines we care about: global properties (object 0), frames, and the first appearance of
+# objects (or changes in their type, pilot, etc). Lines only updating positions (T=...) are skipped
+# without being parsed
+SUMMARY_LINE_REGEX = re.compile(
+    r"^(?:#(?P<frame>[\d.]+)"
+    r"|(?P<id>[0-9a-fA-F]+),(?:T=[^,\n]*,)?"
+    r"(?P<properties>(?:Type|Name|Pilot|Coalition|Color|Event|Title|ReferenceTime|DataRecorder)"
+    r"=.*))$",
+    re.MULTILINE,
+)
+PROPERTY_SEPARATOR_REGEX = re.compile(r"(?<!\\),")
+
+# the kind of object is the first tag of its type that is one of these
+CATEGORIES = ("Air", "Ground", "Sea", "Weapon", "Navaid", "Misc")
+
+
+def open_text(path):
+    """
+    Open an acmi file as text, both if it's zipped (.zip.acmi) or not (.txt.acmi).
+    """
+    if is_zipfile(path):
+        acmi_zip = ZipFile(path)
+        acmi_file = acmi_zip.open(acmi_zip.namelist()[0])
+    else:
+        acmi_file = open(path, "rb")
+
+    return io.TextIOWrapper(acmi_file, encoding="utf-8-sig", errors="replace")
+
+
+def read_blocks(text_file):
+    """
+    Read a text file in blocks of whole lines.
+    """
+    rest = ""
+    while True:
+        block = text_file.read(BLOCK_CHARS)
+        if not block:
+            break
+        block = rest + block
+        last_line_end = block.rfind("\n")
+        if last_line_end == -1:
+            rest = block
+            continue
+        rest = block[last_line_end + 1:]
+        yield block[:last_line_end]
+
+    if rest:
+        yield rest
+
+
+def parse_properties(properties):
+    """
+    Parse the properties of an object line (Name=Value, separated by commas).
+    """
+    parsed = {}
+    for prop in PROPERTY_SEPARATOR_REGEX.split(properties):
+        name, _, value = prop.partition("=")
+        parsed[name] = value.replace("\\,", ",")
+
+    return parsed
+
+
+def get_category(object_type):
+    """
+    Get the category of an object from its type, like Air+FixedWing.
+    """
+    tags = object_type.split("+")
+    for category in CATEGORIES:
+        if category in tags:
+            return category
+    return "Misc"
+
+
+def extract(path):
+    """
+    Extract the summary of a tacview replay. Runs in the catalog extraction processes.
+    """
+    globals_ = {}
+    # only what's needed of the objects that aren't weapons, by id
+    objects = {}
+    object_counts = Counter()
+    pilots = {}
+    destroyed = []
+    losses = Counter()
+    first_frame = last_frame = None
+
+    with open_text(path) as text_file:
+        for block in read_blocks(text_file):
+            for match in SUMMARY_LINE_REGEX.finditer(block):
+                if match.group("frame") is not None:
+                    last_frame = float(match.group("frame"))
+                    if first_frame is None:
+                        first_frame = last_frame
+                    continue
+
+                object_id = match.group("id")
+                properties = parse_properties(match.group("properties"))
+
+                if object_id == "0":
+                    event = properties.get("Event", "")
+                    if event.startswith("Destroyed|"):
+                        destroyed_id = event.split("|")[1]
+                        destroyed_object = objects.get(destroyed_id)
+                        if destroyed_object:
+                            losses[destroyed_object["coalition"]] += 1
+                            if len(destroyed) < MAX_DESTROYED:
+                                destroyed.append({
+                                    # seconds since the start of the replay
+                                    "time": round((last_frame or 0) - (first_frame or 0)),
+                                    **destroyed_object,
+                                })
+                    else:
+                        globals_.update(properties)
+                    continue
+
+                if "Type" in properties and object_id not in objects:
+                    category = get_category(properties["Type"])
+                    object_counts[category] += 1
+                    if category == "Weapon":
+                        continue
+                    objects[object_id] = {"name": "", "pilot": "", "coalition": ""}
+
+                known_object = objects.get(object_id)
+                if known_object is None:
+                    continue
+                known_object["name"] = properties.get("Name", known_object["name"])
+                known_object["pilot"] = properties.get("Pilot", known_object["pilot"])
+                known_object["coalition"] = properties.get(
+                    "Coalition", properties.get("Color", known_object["coalition"])
+                )
+                if known_object["pilot"] and len(pilots) < MAX_PILOTS:
+                    pilots[known_object["pilot"]] = known_object["name"]
+
+    start = end = None
+    if "ReferenceTime" in globals_:
+        reference_time = datetime.fromisoformat(globals_["ReferenceTime"].replace("Z", "+00:00"))
+        start = reference_time + timedelta(seconds=first_frame or 0)
+        end = reference_time + timedelta(seconds=last_frame or 0)
+
+    return TacviewInfo(
+        title=globals_.get("Title", ""),
+        recorder=globals_.get("DataRecorder", ""),
+        start=start.strftime("%Y-%m-%d %H:%M:%S") if start else None,
+        end=end.strftime("%Y-%m-%d %H:%M:%S") if end else None,
+        duration=round((last_frame or 0) - (first_frame or 0)),
+        objects=dict(object_counts),
+        pilots=[{"pilot": pilot, "aircraft": aircraft} for pilot, aircraft in pilots.items()],
+        destroyed=destroyed,
+        losses=dict(losses),
+    )
+
+
+CATALOG_KIND = catalog.Kind(
+    name="tacview",
+    extract=extract,
+    info_type=TacviewInfo,
+    version=1,
+    template="tacview_details.html",
+    search_fields=("title", "pilots", "destroyed"),
+)
@@ -0,0 +1,89 @@
+"""
+Extraction of the information of DCS tracks (.trk files), to show it in the list of tracks:
+mission, theatre, recording date and duration.
+A .trk file is a zip with a copy of the mission (like a .miz) and the recorded inputs. There can
+be thousands of tracks, so instead of parsing their whole missions, only the needed values are
+searched in them.
+The information is kept in the catalog, so each track is only read once:
+
+from dsm import catalog, tracks
+infos = catalog.request_infos(tracks.CATALOG_KIND, tracks_path, page.files, "some-trigger")
+"""
+from collections import namedtuple
+from datetime import datetime
+from zipfile import ZipFile
+import re
+
+from dsm import catalog, lua
+
+
+TrackInfo = namedtuple("TrackInfo", "mission theatre recorded_at duration")
+
+
+def find_string(lua_text, key):
+    """
+    Find the (first) string value of a key in a Lua table, like ["sortie"] = "Some name".
+    """
+    match = re.search(rf'\["{re.escape(key)}"\]\s*=\s*"((?:[^"\\]|\\.)*)"', lua_text)
+    if match:
+        return lua.ESCAPE_REGEX.sub(lua.unescape, match.group(1))
+    return None
+
+
+def read_text(trk, file_name):
+    """
+    Read a text file inside a track, empty if it doesn't exist.
+    """
+    try:
+        return trk.read(file_name).decode("utf-8", errors="replace")
+    except KeyError:
+        return ""
+
+
+def extract(path):
+    """
+    Extract the information of a track file. Runs in the catalog extraction processes.
+    """
+    with ZipFile(path) as trk:
+        mission_text = read_text(trk, "mission")
+        if not mission_text:
+            raise ValueError("The file doesn't contain a mission")
+
+        mission = find_string(mission_text, "sortie") or ""
+        if mission.startswith("DictKey_"):
+            # the name is in the dictionary of texts
+            mission = find_string(read_text(trk, "l10n/DEFAULT/dictionary"), mission) or ""
+
+        # tracks don't say how long they are, but their files are written while recording, so
+        # their dates tell when the recording started and ended. Zip dates are in local time, with
+        # a resolution of 2 seconds, and can be zeroed by some tools
+        written_at = []
+        for file_info in trk.infolist():
+            try:
+                written_at.append(datetime(*file_info.date_time))
+            except ValueError:
+                pass
+
+    if written_at:
+        recorded_at = min(written_at).strftime("%Y-%m-%d %H:%M")
+        duration = round((max(written_at) - min(written_at)).total_seconds())
+    else:
+        recorded_at = duration = None
+
+    return TrackInfo(
+        mission=mission,
+        theatre=find_string(mission_text, "theatre"),
+        recorded_at=recorded_at,
+        duration=duration,
+    )
+
+
+CATALOG_KIND = catalog.Kind(
+    name="track",
+    extract=extract,
+    info_type=TrackInfo,
+    # 2: tracks with invalid file dates are extracted too
+    version=2,
+    template="track_details.html",
+    search_fields=("mission", "theatre"),
+)
@@ -0,0 +1,188 @@
+"""
+Chunked and resumable uploads of (big) files, like missions.
+An upload is started with its file name and size, and then its contents are sent in chunks, each
+one with the offset where it starts. The contents are written straight to a temporary file in
+the destination folder, so if the connection drops the upload can continue from the last offset
+written. When all the chunks are there, the upload is finished with the checksum of the whole
+file, and the temporary file is renamed to its final name.
+It is meant to be used as a singleton, like this:
+
+from dsm import uploads
+upload = uploads.start(missions_path, "mission.miz", size)
+upload = uploads.write_chunk(upload.id, upload.offset, chunk_stream)
+final_path = uploads.finish(upload.id, crc32)
+"""
+from collections import namedtuple
+from hashlib import sha1
+from logging import getLogger
+from pathlib import Path
+import os
+import threading
+import time
+import zlib
+
+from werkzeug.utils import secure_filename
+
+
+logger = getLogger(__name__)
+
+
+Upload = namedtuple("Upload", "id folder_path file_name size offset")
+
+TEMP_SUFFIX = ".part"
+COPY_BUFFER_BYTES = 1024 * 1024
+# temporary files of uploads that were never finished are deleted after this time
+STALE_AFTER_SECONDS = 7 * 24 * 3600
+
+
+class UploadError(Exception):
+    """
+    The upload can't continue as requested. If the problem is the offset, current_offset is the
+    offset where the upload must continue.
+    """
+    def __init__(self, message, current_offset=None):
+        super().__init__(message)
+        self.current_offset = current_offset
+
+
+# uploads in progress, by id
+uploads = {}
+# uploads receiving a chunk right now, only one chunk can be written at a time
+writing = set()
+uploads_lock = threading.Lock()
+
+
+def get_temp_path(upload):
+    """
+    Get the path of the temporary file where the contents of an upload are written.
+    """
+    return upload.folder_path / f".{upload.id}{TEMP_SUFFIX}"
+
+
+def start(folder_path, file_name, size):
+    """
+    Start uploading a file to a folder, or continue uploading it if it was already started (the
+    id is the same for the same file name, size and folder).
+    Returns the upload, with the offset where the contents must continue.
+    """
+    folder_path = Path(folder_path)
+    file_name = secure_filename(file_name)
+    if not file_name:
+        raise UploadError("Invalid file name")
+    if size < 0:
+        raise UploadError("Invalid file size")
+
+    delete_stale(folder_path)
+
+    upload_id = sha1(f"{folder_path}:{file_name}:{size}".encode()).hexdigest()[:20]
+    upload = Upload(upload_id, folder_path, file_name, size, 0)
+
+    temp_path = get_temp_path(upload)
+    if temp_path.exists():
+        upload = upload._replace(offset=temp_path.stat().st_size)
+    else:
+        temp_path.touch()
+
+    with uploads_lock:
+        uploads[upload_id] = upload
+
+    return upload
+
+
+def get(upload_id):
+    """
+    Get an upload in progress, with its current offset.
+    """
+    with uploads_lock:
+        upload = uploads.get(upload_id)
+
+    if upload is None:
+        raise UploadError("Unknown upload, it must be started again")
+
+    temp_path = get_temp_path(upload)
+    if not temp_path.exists():
+        raise UploadError("The upload was cancelled, it must be started again")
+
+    return upload._replace(offset=temp_path.stat().st_size)
+
+
+def write_chunk(upload_id, offset, stream):
+    """
+    Write a chunk of the contents of an upload, read from a stream, at the specified offset (which
+    must be the current end of the uploaded contents).
+    Returns the upload with its new offset.
+    """
+    upload = get(upload_id)
+
+    with uploads_lock:
+        if upload_id in writing:
+            raise UploadError("Another chunk is being written", upload.offset)
+        writing.add(upload_id)
+
+    try:
+        if offset != upload.offset:
+            raise UploadError(f"Wrong offset {offset}, expected {upload.offset}", upload.offset)
+
+        with open(get_temp_path(upload), "r+b") as temp_file:
+            temp_file.seek(offset)
+            while True:
+                data = stream.read(COPY_BUFFER_BYTES)
+                if not data:
+                    break
+                if temp_file.tell() + len(data) > upload.size:
+                    raise UploadError("The uploaded contents are bigger than the file size")
+                temp_file.write(data)
+    finally:
+        with uploads_lock:
+            writing.discard(upload_id)
+
+    return get(upload_id)
+
+
+def finish(upload_id, crc32):
+    """
+    Finish an upload, checking the checksum (crc32) of the uploaded contents and moving them to
+    their final file.
+    Returns the path of the uploaded file. If the final file can't be replaced (it's in use, on
+    windows) the OSError is raised, and the upload is kept so finishing it can be retried.
+    """
+    upload = get(upload_id)
+    if upload.offset != upload.size:
+        raise UploadError(f"The upload is incomplete, {upload.offset} of {upload.size} bytes",
+                          upload.offset)
+
+    temp_path = get_temp_path(upload)
+    checksum = 0
+    with open(temp_path, "rb") as temp_file:
+        while data := temp_file.read(COPY_BUFFER_BYTES):
+            checksum = zlib.crc32(data, checksum)
+
+    if checksum != crc32:
+        # the contents are broken, no way to know from where, it must start again
+        temp_path.unlink()
+        with uploads_lock:
+            uploads.pop(upload_id, None)
+        raise UploadError("The uploaded contents are corrupted (wrong checksum), it must be "
+                          "started again")
+
+    final_path = upload.folder_path / upload.file_name
+    os.replace(temp_path, final_path)
+    with uploads_lock:
+        uploads.pop(upload_id, None)
+
+    logger.info("Finished uploading %s", final_path)
+    return final_path
+
+
+def delete_stale(folder_path):
+    """
+    Delete the temporary files of uploads that were started long ago and never finished.
+    """
+    oldest_allowed = time.time() - STALE_AFTER_SECONDS
+    for temp_path in Path(folder_path).glob(f".*{TEMP_SUFFIX}"):
+        try:
+            if temp_path.stat().st_mtime < oldest_allowed:
+                temp_path.unlink()
+                logger.info("Deleted unfinished upload %s", temp_path)
+        except OSError as err:
+            logger.warning("Failed to delete unfinished upload %s: %s", temp_path, err)
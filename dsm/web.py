@@ -4,16 +4,22 @@ them, and the configs.
 """
 import logging
 import os
+import threading
+import time
+from datetime import datetime
 from enum import Enum
 from uuid import uuid4
 from pathlib import Path
 
-from flask import Flask, render_template, cli, request, send_file
+from flask import Flask, Response, render_template, cli, request, send_file, stream_with_context
+from markupsafe import escape
 from flask_basicauth import BasicAuth
 from werkzeug.utils import secure_filename
 import waitress
 
-from dsm import config, jobs, dcs, srs, logs, VERSION
+from dsm import (config, jobs, actions, dcs, srs, catalog, cleanup, files, logs, log_search,
+                 missions, tacviews, tracks, status, events, metrics, uploads, VERSION)
+from dsm.exceptions import ImproperlyConfigured
 
 
 class MessageKind(Enum):
@@ -71,12 +77,13 @@ def info(text, timeout=None):
     return Message(text, MessageKind.INFO, timeout)
 
 
-def run_in_background(func):
+def run_in_background(func, *args):
     """
     Run a function in the background using the scheduler.
     """
     jobs.scheduler.add_job(
         func=func,
+        args=args,
         trigger="date",  # run once, immediately
         id=f"background_{uuid4()}",
     )
@@ -129,8 +136,29 @@ def launch():
         app.run(host=host, port=port, debug=True)
     else:
         # in prod we use waitress, and we need many threads to support the UI asking for
-        # status while the server is posting updates, etc
-        waitress.serve(app, host=host, port=port, threads=10, _quiet=True)
+        # status while the server is posting updates, etc. Each open browser tab also keeps one
+        # thread busy with its events stream
+        waitress.serve(app, host=host, port=port, threads=32, _quiet=True)
+
+
+@app.before_request
+def start_request_timer():
+    request.started_at = time.monotonic()
+
+
+@app.after_request
+def observe_request_duration(response):
+    # the route pattern is used instead of the path, to avoid having a different histogram for
+    # each file, server, etc. Requests with no matching route (404s) aren't observed
+    started_at = getattr(request, "started_at", None)
+    if request.url_rule is not None and started_at is not None:
+        metrics.observe(
+            "dsm_http_request_duration_seconds",
+            time.monotonic() - started_at,
+            route=request.url_rule.rule,
+            method=request.method,
+        )
+    return response
 
 
 @app.route("/")
@@ -138,7 +166,7 @@ def home():
     """
     Home page.
     """
-    return render_template("home.html")
+    return render_template("home.html", log_levels=log_search.LEVELS)
 
 
 GOOD_ICON = "🟢"
@@ -160,32 +188,40 @@ STATUS_ICONS = {
 
 @app.route("/global_status")
 def global_status():
+    """
+    Status of the servers and jobs, from the latest snapshot taken in the background (so this never
+    has to wait for the servers to answer).
+    """
+    snapshot = status.current
+    if snapshot is None:
+        return warn("Status not checked yet", 3).render("span")
+
     statuses = {}
 
-    for server_name, module in SERVERS.items():
-        try:
-            status = module.current_status()
+    for server_name, server_snapshot in snapshot.servers.items():
+        if server_snapshot.error is None:
+            server_status = server_snapshot.status
             statuses[server_name] = {
-                "status": status,
-                "icon": STATUS_ICONS[status],
-                "text": status.name.replace("_", " ").lower(),
+                "status": server_status,
+                "icon": STATUS_ICONS[server_status],
+                "text": server_status.name.replace("_", " ").lower(),
                 "title": "",
-                "resources": module.current_resources(),
+                "resources": server_snapshot.resources,
             }
 
             if server_name == "dcs":
-                statuses[server_name]["mission"] = dcs.current_mission_status()
-
-        except Exception as err:
+                statuses[server_name]["mission"] = server_snapshot.mission
+                statuses[server_name]["latency"] = server_snapshot.latency
+        else:
             statuses[server_name] = {
                 "status": "unknown",
                 "icon": WARNING_ICON,
                 "text": "failed to get status",
-                "title": str(err),
+                "title": server_snapshot.error,
             }
 
     # job statuses are handled in a different way
-    if jobs.enabled:
+    if snapshot.jobs_enabled:
         statuses["jobs"] = {
             "status": "enabled",
             "icon": GOOD_ICON,
@@ -203,6 +239,110 @@ def global_status():
     return render_template("global_status.html", statuses=statuses)
 
 
+# how often to send something to the browsers, even if nothing changed, so dead connections are
+# detected and closed
+EVENTS_KEEPALIVE_SECONDS = 15
+# events streams are closed after a while, browsers reconnect by themselves. This ensures threads
+# from abandoned connections are eventually released
+EVENTS_STREAM_MAX_SECONDS = 300
+# the fragments that need to read files (hook, DCS version) are rendered this often, or when they
+# are known to have changed. The log size is pushed by the log writer after writing the logs
+SLOW_FRAGMENTS_REFRESH_SECONDS = 60
+SLOW_FRAGMENTS = ("dcs-hook-check", "dcs-version")
+
+# the html fragments pushed to the browsers via the events stream, rendered once and shared by all
+# the streams. The elements in each fragment have the ids of the elements of the page whose
+# contents they replace
+pushed_fragments = {}
+pushed_fragments_lock = threading.Lock()
+
+
+def render_pushed_fragment(name):
+    """
+    Render one of the html fragments that are pushed to the browsers.
+    """
+    if name == "status":
+        return global_status()
+    elif name == "dcs-hook-check":
+        return f'<div id="dcs-hook-check">{dcs_check_hook()}</div>'
+    elif name == "dcs-version":
+        return f'<span id="dcs-version">{escape(dcs_version())}</span>'
+    elif name == "log-size":
+        return f'<span id="log-size">{log_size()}</span>'
+    raise ValueError(f"Unknown pushed fragment {name}")
+
+
+def refresh_pushed_fragments(names=SLOW_FRAGMENTS):
+    """
+    Render again some of the pushed fragments, and notify the events streams if any of them
+    changed. Called when the status snapshot is refreshed, periodically for the slow fragments,
+    and when something is known to change them.
+    """
+    # the fragments are rendered outside of any request, but they use the request to show messages
+    with app.test_request_context():
+        rendered = {name: render_pushed_fragment(name) for name in names}
+
+    with pushed_fragments_lock:
+        changed = [name for name, fragment in rendered.items()
+                   if pushed_fragments.get(name) != fragment]
+        pushed_fragments.update(rendered)
+
+    if changed:
+        events.notify()
+
+
+def as_server_sent_event(data, event_id=None):
+    """
+    Format some data as a server-sent event.
+    """
+    event = "".join(f"data: {line}\n" for line in data.splitlines())
+    if event_id is not None:
+        event += f"id: {event_id}\n"
+    return event + "\n"
+
+
+@app.route("/events")
+def events_stream():
+    """
+    Stream of server-sent events, pushing to the browser the parts of the page that changed since
+    the last push (status, hook, log size, etc), and triggers for the parts of the page that must
+    reload themselves (like lists of files).
+    The fragments aren't rendered here, each stream just sends the ones rendered for everyone.
+    """
+    def stream():
+        pushed = {}
+        last_version = None
+        stream_start = time.monotonic()
+
+        while time.monotonic() - stream_start < EVENTS_STREAM_MAX_SECONDS:
+            new_version = events.wait(last_version, timeout=EVENTS_KEEPALIVE_SECONDS)
+
+            # sent even if nothing changed, so a status that stops being refreshed is noticed.
+            # It also checks the connection is still alive
+            age = status.age()
+            age_text = "..." if age is None else f"{age:.0f}s ago"
+            yield as_server_sent_event(f'<span id="status-age">{age_text}</span>')
+            if new_version == last_version:
+                continue
+
+            for trigger in events.triggers_since(last_version):
+                yield f"event: trigger\ndata: {trigger}\n\n"
+            last_version = new_version
+
+            with pushed_fragments_lock:
+                fragments = dict(pushed_fragments)
+            for name, fragment in fragments.items():
+                if pushed.get(name) != fragment:
+                    pushed[name] = fragment
+                    yield as_server_sent_event(fragment)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @app.route("/<server_name>/start", methods=["POST"])
 def server_start(server_name):
     try:
@@ -336,7 +476,59 @@ def server_config_form(server_name, restart=False):
     )
 
 
-def files_in_folder(folder_path, glob_filter, files_form_id):
+# lists of files shown in the UI, by the id of the element that shows them: (function that returns
+# the folder, glob filter of the files shown)
+FILES_VIEWS = {
+    "dcs-missions": (dcs.get_missions_path, "*." + dcs.MISSION_FILE_EXTENSION),
+    "dcs-tracks": (dcs.get_tracks_path, "*." + dcs.TRACK_FILE_EXTENSION),
+    "dcs-tacviews": (dcs.get_tacviews_path, "*." + dcs.TACVIEW_FILE_EXTENSION),
+    "log-files": (lambda: logs.get_path().parent, ("*.log", "*.log.gz")),
+}
+
+
+def get_watched_folders():
+    """
+    Get the folders of the lists of files shown in the UI, to watch them for changes, in the
+    format expected by files.watch. Folders that aren't configured are skipped.
+    """
+    watched_folders = {}
+    for name, (get_folder, glob_filter) in FILES_VIEWS.items():
+        try:
+            watched_folders[name] = (get_folder(), glob_filter)
+        except ImproperlyConfigured:
+            pass
+
+    return watched_folders
+
+
+def send_download(file_path, download_name=None, mimetype=None):
+    """
+    Send a file as a download, supporting conditional requests (ETag and Last-Modified, answered
+    with 304 if the browser already has it) and byte ranges (so interrupted downloads of huge
+    tracks and tacviews can be resumed instead of started again).
+    """
+    response = send_file(
+        file_path,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+    )
+
+    if response.status_code == 206 and request.environ.get("SERVER_SOFTWARE") == "waitress":
+        # werkzeug sends ranges by iterating the file in the worker thread. Instead, we give
+        # waitress the file already at the start of the range, so it's sent by its main loop
+        # straight from the file (limited by the content length), like full downloads
+        response.response.close()
+        range_file = open(file_path, "rb")
+        range_file.seek(response.content_range.start)
+        response.response = request.environ["wsgi.file_wrapper"](range_file)
+
+    return response
+
+
+def files_in_folder(folder_path, glob_filter, files_form_id, catalog_kind=None):
     """
     View that lists files in the specified folder, with the specified glob filter, and allows for
     some basic interactions with them.
@@ -345,9 +537,28 @@ def files_in_folder(folder_path, glob_filter, files_form_id):
     If it's a POST and "upload_file" is in request.files, it will upload the file to the folder.
     If it's a POST and there are "file-..." keys in request.form, it will delete those files.
 
-    For anything except the file download case, the list of current files is returned as html at
-    the end.
+    For anything except the file download case, a page of the current files is returned as html
+    at the end, sorted and filtered according to the "sort", "order", "filter" and "page" values.
+    If a catalog kind is specified, the files are shown with the information extracted from them.
     """
+    if request.method == "POST" and request.form.get("action") == "download-archive":
+        # downloading the selected files as a zip case. The form is submitted by the browser
+        # itself (not by htmx), so if nothing was selected we just don't answer anything
+        file_names = [
+            key.replace("file-", "", 1)
+            for key in request.form
+            if key.startswith("file-")
+        ]
+        if not file_names:
+            return "", 204
+
+        archive_name = f"{files_form_id.removesuffix('-form')}_{datetime.now():%Y%m%d_%H%M%S}.zip"
+        return Response(
+            stream_with_context(files.stream_zip(folder_path, file_names)),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f"attachment; filename={archive_name}"},
+        )
+
     if request.method == "POST":
         if "upload_file" in request.files:
             # uploading a file case
@@ -359,58 +570,155 @@ def files_in_folder(folder_path, glob_filter, files_form_id):
             else:
                 filename = secure_filename(file.filename)
                 file.save(folder_path / filename)
+                files.update(folder_path, filename)
                 info(f"{filename} uploaded", 6)
         elif any(key.startswith("file-") for key in request.form):
-            # deleting files case
-            deleted_count = 0
-            for key in request.form:
-                if key.startswith("file-"):
-                    file_name = key.replace("file-", "")
-                    file_path = folder_path / file_name
-                    if file_path.exists():
-                        file_path.unlink()
-                        deleted_count += 1
-                    else:
-                        warn(f"Can't delete {file_name}, no longer exist")
-
-            if deleted_count:
-                info(f"{deleted_count} files deleted", 6)
+            # deleting files case. There can be hundreds of them, so they are deleted in the
+            # background, and the list shows the progress until it finishes
+            file_names = [
+                key.replace("file-", "", 1)
+                for key in request.form
+                if key.startswith("file-")
+            ]
+            task = cleanup.start_delete(folder_path, file_names)
+            run_in_background(cleanup.run_delete, task.id)
 
     if "download_file" in request.args:
         # downloading a file case
         file_name = request.args["download_file"]
         file_path = folder_path / file_name
         if file_path.exists():
-            return send_file(file_path, as_attachment=True)
+            return send_download(file_path)
         else:
             return warn(f"Can't download {file_name}, no longer exists").render(), 404
 
     if folder_path.exists():
-        files = [
-            file_path
-            for file_path in folder_path.glob(glob_filter)
-            if file_path.is_file()
-        ]
+        filter_text = request.values.get("filter", "")
+        files_page = files.list_files(
+            folder_path,
+            glob_filter,
+            sort=request.values.get("sort", "date"),
+            descending=request.values.get("order", "desc") == "desc",
+            filter_text=filter_text,
+            page=request.values.get("page", 1, type=int),
+            # the filter also searches the information extracted from the files
+            matching_names=(catalog.search(catalog_kind, folder_path, filter_text)
+                            if catalog_kind and filter_text else ()),
+        )
     else:
-        files = []
+        files_page = None
         warn(f"Folder {folder_path} does not exist")
 
+    files_details = None
+    if files_page and catalog_kind:
+        # files not extracted yet are shown without details, and the list is refreshed when they
+        # are ready
+        files_details = catalog.request_infos(
+            catalog_kind,
+            folder_path,
+            files_page.files,
+            trigger=f"files-changed-{files_form_id.removesuffix('-form')}",
+        )
+
     return render_template(
         "files_list.html",
-        files=files,
+        files_page=files_page,
         files_form_id=files_form_id,
+        files_details=files_details,
+        details_template=catalog_kind.template if catalog_kind else None,
+        delete_tasks=cleanup.get_running_tasks(folder_path),
     )
 
 
+@app.route("/files/delete/<task_id>")
+def files_delete_progress(task_id):
+    """
+    Progress of a task deleting files in the background.
+    """
+    task = cleanup.get_task(task_id)
+    if task is None:
+        return ""
+
+    if task.finished_at is None:
+        return render_template("delete_progress.html", task=task)
+    elif task.failed:
+        return warn(f"{task.deleted} files deleted, failed to delete {task.failed} files").render()
+    else:
+        return info(f"{task.deleted} files deleted", 6).render()
+
+
 @app.route("/dcs/missions", methods=["GET", "POST"])
 def dcs_missions():
+    get_folder, glob_filter = FILES_VIEWS["dcs-missions"]
     return files_in_folder(
-        folder_path=dcs.get_missions_path(),
-        glob_filter="*." + dcs.MISSION_FILE_EXTENSION,
+        folder_path=get_folder(),
+        glob_filter=glob_filter,
         files_form_id="dcs-missions-form",
+        catalog_kind=missions.CATALOG_KIND,
     )
 
 
+def upload_as_json(upload):
+    """
+    The state of an upload, as returned by the upload endpoints.
+    """
+    return {"id": upload.id, "file_name": upload.file_name, "size": upload.size,
+            "offset": upload.offset}
+
+
+@app.route("/dcs/missions/upload", methods=["POST"])
+def dcs_missions_upload_start():
+    """
+    Start (or continue) a chunked upload of a mission file. Expects the "name" and "size" of the
+    file, returns the upload id and the offset from which the chunks must be sent.
+    """
+    data = request.get_json()
+    try:
+        upload = uploads.start(dcs.get_missions_path(), data.get("name", ""), int(data["size"]))
+        return upload_as_json(upload)
+    except (uploads.UploadError, KeyError, ValueError) as err:
+        return {"error": str(err)}, 400
+
+
+@app.route("/dcs/missions/upload/<upload_id>", methods=["PUT"])
+def dcs_missions_upload_chunk(upload_id):
+    """
+    Write a chunk of a mission upload. The body is the contents, "offset" (in the query string)
+    where it starts. If the offset is wrong, answers 409 with the offset expected.
+    """
+    try:
+        upload = uploads.write_chunk(upload_id, request.args.get("offset", type=int),
+                                     request.stream)
+        return upload_as_json(upload)
+    except uploads.UploadError as err:
+        if err.current_offset is not None:
+            return {"error": str(err), "offset": err.current_offset}, 409
+        return {"error": str(err)}, 400
+
+
+@app.route("/dcs/missions/upload/<upload_id>/finish", methods=["POST"])
+def dcs_missions_upload_finish(upload_id):
+    """
+    Finish a mission upload, checking the "crc32" of its contents.
+    """
+    try:
+        final_path = uploads.finish(upload_id, int(request.get_json()["crc32"]))
+        files.update(final_path.parent, final_path.name)
+        return {"file_name": final_path.name}
+    except uploads.UploadError as err:
+        if err.current_offset is not None:
+            return {"error": str(err), "offset": err.current_offset}, 409
+        return {"error": str(err)}, 400
+    except (KeyError, ValueError) as err:
+        return {"error": f"Invalid checksum: {err}"}, 400
+    except OSError as err:
+        # usually the file is in use (like the mission running in DCS, on windows). The upload is
+        # kept, so uploading the same file again just retries finishing it
+        logger.warning("Failed to save the uploaded mission: %s", err)
+        return {"error": f"Can't save the file, it might be in use ({err}). Upload it again to "
+                         f"retry"}, 409
+
+
 @app.route("/dcs/missions/run", methods=["POST"])
 def dcs_missions_run():
     """
@@ -447,41 +755,66 @@ def dcs_missions_run():
 
 @app.route("/dcs/tracks", methods=["GET", "POST"])
 def dcs_tracks():
+    get_folder, glob_filter = FILES_VIEWS["dcs-tracks"]
     return files_in_folder(
-        folder_path=dcs.get_tracks_path(),
-        glob_filter="*." + dcs.TRACK_FILE_EXTENSION,
+        folder_path=get_folder(),
+        glob_filter=glob_filter,
         files_form_id="dcs-tracks-form",
+        catalog_kind=tracks.CATALOG_KIND,
     )
 
 
 @app.route("/dcs/tacviews", methods=["GET", "POST"])
 def dcs_tacviews():
+    get_folder, glob_filter = FILES_VIEWS["dcs-tacviews"]
     return files_in_folder(
-        folder_path=dcs.get_tacviews_path(),
-        glob_filter="*." + dcs.TACVIEW_FILE_EXTENSION,
+        folder_path=get_folder(),
+        glob_filter=glob_filter,
         files_form_id="dcs-tacviews-form",
+        catalog_kind=tacviews.CATALOG_KIND,
     )
 
 
 @app.route("/dcs/mission_status", methods=["POST"])
 def dcs_mission_status():
     # POSTs to this endpoint are meant to be used by the DCS server hook to update the
-    # current mission status, while also consuming the pending actions. So we both update the
-    # mission status, and consume+return the pending actions.
+    # current mission status. Hooks installed by older versions also consume the pending actions
+    # with them, so for those we both update the mission status, and consume+return the pending
+    # actions.
     data = request.get_json()
+    metrics.increment("dsm_dcs_hook_posts_total")
+
+    if data.get("v") == 2:
+        # only changes are posted, if some were missed the hook must send everything again. The
+        # actions aren't sent here, the hook waits for them in /dcs/actions
+        applied = dcs.apply_hook_update(data)
+        return {"resync": not applied}
+
+    # hooks installed by older versions post the whole status every time
     dcs.set_mission_status(
         mission=data.get("mission", "Unknown"),
         players=data.get("players", []),
         paused=data.get("paused", "Unknown"),
     )
+    return {"actions": actions.consume()}
 
-    return {"actions": dcs.consume_pending_actions()}
+
+@app.route("/dcs/actions", methods=["POST"])
+def dcs_actions():
+    # long poll used by the DCS server hook to get the pending actions as soon as they are queued.
+    # Each poll acknowledges the actions executed since the previous one
+    data = request.get_json()
+    pending = actions.wait_pending(
+        acknowledged_ids=data.get("ack") or [],
+        wait=float(data.get("wait") or 0),
+    )
+    return {"actions": pending}
 
 
 @app.route("/dcs/pause", methods=["POST"], defaults={"action": "pause"})
 @app.route("/dcs/unpause", methods=["POST"], defaults={"action": "unpause"})
 def dcs_queue_pending_action(action):
-    dcs.add_pending_action(action)
+    actions.add(action)
     return info(f"{action.capitalize()} requested").render("span")
 
 
@@ -489,6 +822,7 @@ def dcs_queue_pending_action(action):
 def dcs_install_hook():
     try:
         dcs.install_hook()
+        refresh_pushed_fragments(["dcs-hook-check"])
         return info("Hook installed, restart the DCS Server to apply changes").render()
     except Exception as err:
         return error(f"Failed to install hook: {err}").render()
@@ -498,6 +832,7 @@ def dcs_install_hook():
 def dcs_uninstall_hook():
     try:
         dcs.uninstall_hook()
+        refresh_pushed_fragments(["dcs-hook-check"])
         return info("Hook uninstalled, restart the DCS Server to apply changes").render()
     except Exception as err:
         return error(f"Failed to uninstall hook: {err}").render()
@@ -580,22 +915,102 @@ def jobs_disable():
         return error(f"Failed to disable jobs: {err}").render("span")
 
 
+LOGS_MAX_TAIL_LINES = 5000
+LOGS_FOLLOW_CHECK_EVERY_SECONDS = 1
+
+
 @app.route("/logs")
 def log_contents():
+    """
+    The last lines of the logs. Accepts "tail" (number of lines) and "before" (byte offset, to
+    page backwards through older lines).
+    """
+    tail = min(request.args.get("tail", logs.TAIL_LINES, type=int), LOGS_MAX_TAIL_LINES)
+    before = request.args.get("before", type=int)
+
     try:
-        contents = logs.read_contents()
-        if contents is None:
+        chunk = logs.read_tail(lines=max(tail, 1), before=before)
+        if chunk is None:
             return warn("No log file found").render("span")
         else:
-            return contents
+            return render_template("logs_chunk.html", chunk=chunk, tail=tail,
+                                   older=before is not None)
     except Exception as err:
         return error(f"Failed to read logs: {err}").render("span")
 
 
+@app.route("/logs/follow")
+def log_follow():
+    """
+    Stream of server-sent events with the new lines appended to the logs after the "offset" byte
+    offset. The id of each event is the offset after its lines, so when the browser reconnects it
+    continues where it left.
+    """
+    offset = request.headers.get("Last-Event-ID", type=int)
+    if offset is None:
+        offset = request.args.get("offset", 0, type=int)
+
+    def stream():
+        nonlocal offset
+        stream_start = time.monotonic()
+        last_sent = stream_start
+
+        while time.monotonic() - stream_start < EVENTS_STREAM_MAX_SECONDS:
+            chunk = logs.read_from(offset)
+            if chunk and chunk.text:
+                offset = chunk.end
+                last_sent = time.monotonic()
+                yield as_server_sent_event(chunk.text, event_id=offset)
+            elif chunk and chunk.start < offset:
+                # the logs were emptied or archived, continue from the beginning of the new file
+                offset = chunk.start
+            elif time.monotonic() - last_sent > EVENTS_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            else:
+                time.sleep(LOGS_FOLLOW_CHECK_EVERY_SECONDS)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.route("/logs/search")
+def log_search_results():
+    """
+    Search the current and archived logs. Accepts the words to find, the level, the server and
+    the time range ("from" and "to", as iso datetimes).
+    """
+    try:
+        search_start = time.monotonic()
+        from_time = request.args.get("from")
+        to_time = request.args.get("to")
+        matches = log_search.search(
+            words=request.args.get("words", ""),
+            level=request.args.get("level") or None,
+            server=request.args.get("server") or None,
+            from_time=datetime.fromisoformat(from_time) if from_time else None,
+            to_time=datetime.fromisoformat(to_time) if to_time else None,
+        )
+        return render_template(
+            "logs_search.html",
+            matches=matches,
+            max_results=log_search.MAX_RESULTS,
+            duration=time.monotonic() - search_start,
+            # the index is still catching up with the logs (the first time, after rotations...)
+            indexing=log_search.get_unindexed_bytes() > log_search.CATCH_UP_MAX_BYTES,
+        )
+    except Exception as err:
+        return error(f"Failed to search logs: {err}").render("span")
+
+
 @app.route("/log/clear", methods=["POST"])
 def log_clear():
     try:
         logs.clear()
+        refresh_pushed_fragments(["log-size"])
         return info("Logs emptied").render("span")
     except Exception as err:
         return error(f"Failed to empty logs: {err}").render("span")
@@ -605,6 +1020,7 @@ def log_clear():
 def log_archive():
     try:
         archive_path = logs.archive()
+        refresh_pushed_fragments(["log-size"])
         if archive_path is None:
             return warn("No log file found").render("span")
         else:
@@ -628,13 +1044,113 @@ def log_size():
 
 @app.route("/log/files", methods=["GET", "POST"])
 def log_files():
+    folder_path = logs.get_path().parent
+    file_name = request.args.get("download_file", "")
+
+    if file_name.endswith(".gz") and (folder_path / file_name).exists():
+        # compressed archives are sent as they are, so ranges and sizes are those of the
+        # compressed file
+        return send_download(folder_path / file_name, mimetype="application/gzip")
+
     return files_in_folder(
-        folder_path=logs.get_path().parent,
-        glob_filter="*.log",
+        folder_path=folder_path,
+        glob_filter=FILES_VIEWS["log-files"][1],
         files_form_id="log-files-form",
     )
 
 
+@app.route("/metrics")
+def prometheus_metrics():
+    """
+    Current status of the servers and stats about DSM, in the Prometheus text format, so they can
+    be scraped by Prometheus or any compatible monitoring tool.
+    Built from the latest status snapshot, so scraping doesn't check the servers.
+    """
+    return Response(
+        metrics.render_prometheus(status.current),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@app.route("/metrics/history")
+def metrics_history():
+    """
+    History of a server status and resources, as json. Accepts the server name, the period as
+    "from" and "to" unix timestamps (last 24 hours if not specified) and the "step" in seconds of
+    the buckets in which the samples are aggregated (chosen automatically if not specified).
+    """
+    server_name = request.args.get("server", "dcs")
+    if server_name not in SERVERS:
+        return {"error": f"Unknown server {server_name}"}, 400
+
+    to_time = request.args.get("to", type=int) or int(time.time())
+    from_time = request.args.get("from", type=int) or to_time - HISTORY_PERIODS["24h"]
+    step = request.args.get("step", type=int)
+    if step is not None and step <= 0:
+        return {"error": "The step must be a positive number of seconds"}, 400
+
+    return metrics.history(server_name, from_time, to_time, step)
+
+
+HISTORY_PERIODS = {
+    "6h": 6 * 3600,
+    "24h": 24 * 3600,
+    "7d": 7 * 24 * 3600,
+    "30d": 30 * 24 * 3600,
+}
+CHART_WIDTH = 600
+CHART_HEIGHT = 150
+
+
+@app.route("/metrics/chart")
+def metrics_chart():
+    """
+    Chart of the history of one value of a server (cpu, memory, etc), drawn as svg.
+    """
+    server_name = request.args.get("server", "dcs")
+    value = request.args.get("value", "cpu")
+    period = request.args.get("period", "24h")
+
+    if server_name not in SERVERS or value not in metrics.VALUES or period not in HISTORY_PERIODS:
+        return error("Invalid chart options").render()
+
+    to_time = int(time.time())
+    from_time = to_time - HISTORY_PERIODS[period]
+    series = [
+        (bucket["time"], bucket[value])
+        for bucket in metrics.history(server_name, from_time, to_time)["series"]
+        if bucket[value]["avg"] is not None
+    ]
+
+    if not series:
+        return info("No history for this period yet").render()
+
+    lowest = min(values["min"] for _, values in series)
+    highest = max(values["max"] for _, values in series)
+    value_range = (highest - lowest) or 1
+
+    def point(time_, chart_value):
+        x = (time_ - from_time) / (to_time - from_time) * CHART_WIDTH
+        y = CHART_HEIGHT - (chart_value - lowest) / value_range * CHART_HEIGHT
+        return f"{x:.1f},{y:.1f}"
+
+    return render_template(
+        "metrics_chart.html",
+        width=CHART_WIDTH,
+        height=CHART_HEIGHT,
+        avg_points=" ".join(point(t, values["avg"]) for t, values in series),
+        # the band goes from left to right through the max values, and back through the min ones
+        band_points=" ".join(
+            [point(t, values["max"]) for t, values in series]
+            + [point(t, values["min"]) for t, values in reversed(series)]
+        ),
+        lowest=lowest,
+        highest=highest,
+        from_time=datetime.fromtimestamp(from_time),
+        to_time=datetime.fromtimestamp(to_time),
+    )
+
+
 @app.route("/version")
 def version():
     """
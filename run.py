@@ -3,6 +3,7 @@ Script meant to run the app itself.
 """
 from pathlib import Path
 import logging
+import multiprocessing
 
 import click
 
@@ -34,4 +35,6 @@ def run_dcs_server_manager(config_path):
 
 
 if __name__ == "__main__":
+    # needed by the background processes (like the ones that read missions) in the exe
+    multiprocessing.freeze_support()
     run_dcs_server_manager()
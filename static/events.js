@@ -0,0 +1,81 @@
+(function () {
+
+    /**
+     * Listen to the server-sent events stream, which pushes html fragments when things change.
+     * Each element with an id in a fragment replaces the contents of the element with the same id
+     * in the page.
+     */
+    function swapFragment(html) {
+        var template = document.createElement('template');
+        template.innerHTML = html;
+
+        template.content.querySelectorAll('[id]').forEach(function (element) {
+            var target = document.getElementById(element.id);
+            // only top level elements of the fragment, nested ones are swapped with their parents
+            if (target && !element.parentElement?.closest('[id]')) {
+                target.innerHTML = element.innerHTML;
+                htmx.process(target);
+            }
+        });
+    }
+
+    /**
+     * Follow the logs: stream the lines appended to the log file after the last loaded ones, and
+     * append them to the logs viewer.
+     */
+    var logsSource = null;
+
+    function followLogs(loadIfNeeded) {
+        var logs = document.getElementById('logs');
+        var follow = document.getElementById('logs-follow');
+
+        if (logsSource) {
+            logsSource.close();
+            logsSource = null;
+        }
+        if (!follow.checked) {
+            return;
+        }
+
+        var end = logs.querySelector('.logs-end');
+        if (!end) {
+            if (loadIfNeeded) {
+                // logs not loaded yet, load them and start following after that (afterSwap)
+                htmx.ajax('GET', '/logs', '#logs');
+            }
+            return;
+        }
+
+        logsSource = new EventSource('/logs/follow?offset=' + end.dataset.offset);
+        logsSource.onmessage = function (event) {
+            var atBottom = logs.scrollTop + logs.clientHeight >= logs.scrollHeight - 5;
+            logs.append(document.createTextNode(event.data + '\n'));
+            if (atBottom) {
+                logs.scrollTop = logs.scrollHeight;
+            }
+        };
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        // the browser reconnects by itself if the stream is closed
+        var source = new EventSource('/events');
+        source.onmessage = function (event) {
+            swapFragment(event.data);
+        };
+        // triggers let parts of the page react to changes, like reloading a list of files
+        source.addEventListener('trigger', function (event) {
+            htmx.trigger(document.body, event.data);
+        });
+
+        document.getElementById('logs-follow').addEventListener('change', function () {
+            followLogs(true);
+        });
+        document.body.addEventListener('htmx:afterSwap', function (event) {
+            // fresh logs were loaded, follow from their end
+            if (event.detail.target.id === 'logs') {
+                event.detail.target.scrollTop = event.detail.target.scrollHeight;
+                followLogs(false);
+            }
+        });
+    });
+})();
@@ -0,0 +1,120 @@
+(function () {
+
+    // chunks are small enough to not lose much when the connection drops
+    var CHUNK_BYTES = 8 * 1024 * 1024;
+    var MAX_RETRIES = 10;
+
+    var CRC_TABLE = (function () {
+        var table = [];
+        for (var n = 0; n < 256; n++) {
+            var c = n;
+            for (var k = 0; k < 8; k++) {
+                c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+            }
+            table[n] = c >>> 0;
+        }
+        return table;
+    })();
+
+    /**
+     * Update a crc32 checksum with more bytes (same results as python's zlib.crc32).
+     */
+    function crc32(crc, bytes) {
+        crc = crc ^ 0xFFFFFFFF;
+        for (var i = 0; i < bytes.length; i++) {
+            crc = CRC_TABLE[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+        }
+        return (crc ^ 0xFFFFFFFF) >>> 0;
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function postJson(url, data) {
+        var response = await fetch(url, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(data),
+        });
+        // unexpected errors might not be answered with json
+        var result = await response.json().catch(function () { return null; });
+        if (!response.ok || result === null) {
+            throw new Error(result ? result.error : 'unexpected answer (' + response.status + ')');
+        }
+        return result;
+    }
+
+    /**
+     * Upload a file in chunks to the specified url (see the /dcs/missions/upload endpoints).
+     * If the upload was already started (even in another page load), it continues from where it
+     * was left. Chunks that fail are retried, continuing from the offset the server has.
+     */
+    async function uploadFile(url, file, onProgress, retries) {
+        retries = retries || 0;
+        var upload = await postJson(url, {name: file.name, size: file.size});
+        var offset = upload.offset;
+        var checksum = 0;
+
+        // the checksum of the part that was already uploaded is calculated from the local file
+        for (var start = 0; start < offset; start += CHUNK_BYTES) {
+            var done = new Uint8Array(await file.slice(start, Math.min(start + CHUNK_BYTES, offset)).arrayBuffer());
+            checksum = crc32(checksum, done);
+        }
+
+        while (offset < file.size) {
+            var chunk = new Uint8Array(await file.slice(offset, offset + CHUNK_BYTES).arrayBuffer());
+            try {
+                var response = await fetch(url + '/' + upload.id + '?offset=' + offset, {
+                    method: 'PUT',
+                    headers: {'Content-Type': 'application/octet-stream'},
+                    body: chunk,
+                });
+                var result = await response.json();
+                if (response.status === 409) {
+                    // the server has a different part of the file, start over from there
+                    return uploadFile(url, file, onProgress, retries);
+                } else if (!response.ok) {
+                    throw new Error(result.error);
+                }
+                checksum = crc32(checksum, chunk.subarray(0, result.offset - offset));
+                offset = result.offset;
+                retries = 0;
+                onProgress(offset, file.size);
+            } catch (err) {
+                if (retries >= MAX_RETRIES) {
+                    throw err;
+                }
+                await sleep(1000 * (retries + 1));
+                return uploadFile(url, file, onProgress, retries + 1);
+            }
+        }
+
+        return postJson(url + '/' + upload.id + '/finish', {crc32: checksum});
+    }
+
+    window.uploadMission = async function () {
+        var input = document.querySelector('#mission-upload-form input[type=file]');
+        var working = document.getElementById('mission-upload-working');
+        var progress = document.getElementById('mission-upload-progress');
+
+        if (!input.files.length) {
+            progress.textContent = 'No file selected to be uploaded';
+            return;
+        }
+
+        working.classList.add('htmx-request');
+        try {
+            var result = await uploadFile('/dcs/missions/upload', input.files[0], function (offset, size) {
+                progress.textContent = 'Uploaded ' + Math.floor(100 * offset / size) + '%';
+            });
+            progress.textContent = result.file_name + ' uploaded';
+            input.value = '';
+            htmx.trigger(document.body, 'files-changed-dcs-missions');
+        } catch (err) {
+            progress.textContent = 'Failed to upload: ' + err.message;
+        } finally {
+            working.classList.remove('htmx-request');
+        }
+    };
+})();
@@ -1,64 +1,232 @@
 -- HOOK FROM DSM %VERSION%
 local socket = require("socket")
-local url = require("url") -- defines socket.url, which socket.http looks for
-local http = require("socket.http")
-local ltn12 = require("ltn12")
+local mime = require("mime")
+
+-- the DSM address can include credentials, like admin:password@localhost:9999
+local dsm_credentials, dsm_address = string.match("%HOST%", "^(.*)@([^@]*)$")
+dsm_address = dsm_address or "%HOST%"
+local dsm_host, dsm_port = string.match(dsm_address, "^(.*):(%d+)$")
+dsm_port = tonumber(dsm_port)
+-- resolved only once, name lookups block
+local dsm_ip = socket.dns.toip(dsm_host) or dsm_host
 
 local DsmHooks = {
     update_interval = 3,  -- seconds
+    full_update_every = 20,  -- updates, a full snapshot is sent every this many updates anyway
     last_update = 0,
-    dsm_endpoint = "http://%HOST%/dcs/mission_status",
+    -- protocol v2: only what changed since the previous update is posted. The session identifies
+    -- this load of the hook, and the sequence number lets DSM detect missed updates
+    session = string.format("%.0f", socket.gettime() * 1000),
+    sequence = 0,
+    known_by_dsm = nil,  -- the status DSM knows, nil if it must get a full snapshot
+    -- requests to DSM never block the simulation: they are advanced a bit in each frame
+    status_request = nil,
+    -- actions are received with long polls, DSM answers as soon as there are actions to execute
+    actions_wait = 20,  -- seconds
+    actions_request = nil,
+    actions_retry_at = 0,
+    actions_retry_interval = 5,  -- seconds
+    actions_to_ack = {},  -- ids of the executed actions, until DSM gets the acknowledgement
 }
 
-DsmHooks.post_status = function()
-    local mission = DCS.getMissionName() or "Unknown"
-    local paused = DCS.getPause()
+DsmHooks.current_status = function()
     local players = {}
-
-    for id, player in pairs(net.get_player_list() or {}) do
-        local name = net.get_player_info(id, 'name') or 'Unknown'
-        table.insert(players, name)
+    for _, id in pairs(net.get_player_list() or {}) do
+        players[id] = net.get_player_info(id, 'name') or 'Unknown'
     end
 
-    local body = {
-        mission = mission,
+    return {
+        mission = DCS.getMissionName() or "Unknown",
+        paused = DCS.getPause(),
         players = players,
-        paused = paused
     }
+end
 
-    local body_as_json = net.lua2json(body)
-    local response_body = {}
-
-    local response, err_or_status = http.request{
-        url = DsmHooks.dsm_endpoint,
-        method = "POST",
-        headers = {
-            ["Content-Type"] = "application/json",
-            ["Content-Length"] = tostring(#body_as_json)
-        },
-        source = ltn12.source.string(body_as_json),
-        sink = ltn12.sink.table(response_body),
-        create = function()
-            local req_sock = socket.tcp()
-            req_sock:settimeout(10, 'b')  -- no activity timeout
-            req_sock:settimeout(15, 't')  -- total request timeout
-            return req_sock
+DsmHooks.build_update = function(status)
+    DsmHooks.sequence = DsmHooks.sequence + 1
+    local update = {v = 2, session = DsmHooks.session, seq = DsmHooks.sequence}
+    local known = DsmHooks.known_by_dsm
+
+    if known == nil or DsmHooks.sequence % DsmHooks.full_update_every == 0 then
+        update.full = true
+        update.mission = status.mission
+        update.paused = status.paused
+        update.players = {}
+        for id, name in pairs(status.players) do
+            table.insert(update.players, {id = id, name = name})
+        end
+    else
+        if status.mission ~= known.mission then
+            update.mission = status.mission
+        end
+        if status.paused ~= known.paused then
+            update.paused = status.paused
+        end
+
+        local joined = {}
+        local left = {}
+        for id, name in pairs(status.players) do
+            if known.players[id] ~= name then
+                table.insert(joined, {id = id, name = name})
+            end
+        end
+        for id, _ in pairs(known.players) do
+            if status.players[id] == nil then
+                table.insert(left, id)
+            end
+        end
+        if #joined > 0 then
+            update.joined = joined
         end
+        if #left > 0 then
+            update.left = left
+        end
+    end
+
+    return update
+end
+
+DsmHooks.start_request = function(path, body, timeout)
+    -- start a non blocking POST to DSM. HTTP/1.0, so the answer is never chunked, and it ends
+    -- when DSM closes the connection
+    local body_as_json = net.lua2json(body)
+    local headers = {
+        "POST " .. path .. " HTTP/1.0",
+        "Host: " .. dsm_address,
+        "Content-Type: application/json",
+        "Content-Length: " .. tostring(#body_as_json),
+    }
+    if dsm_credentials then
+        table.insert(headers, "Authorization: Basic " .. (mime.b64(dsm_credentials)))
+    end
+
+    local sock = socket.tcp()
+    sock:settimeout(0)
+    local ok, err = sock:connect(dsm_ip, dsm_port)
+    if not ok and err ~= "timeout" then
+        sock:close()
+        error("can't connect to DSM: " .. tostring(err))
+    end
+
+    return {
+        sock = sock,
+        data = table.concat(headers, "\r\n") .. "\r\n\r\n" .. body_as_json,
+        sent = 0,
+        received = {},
+        connected = ok ~= nil,
+        timeout_at = socket.gettime() + timeout,
     }
+end
+
+DsmHooks.advance_request = function(request)
+    -- advance a request without blocking. Returns nil while it's not finished, then the parsed
+    -- body of the answer (raising an error if it failed)
+    if socket.gettime() > request.timeout_at then
+        request.sock:close()
+        error("timeout")
+    end
 
-    if response == nil then
-        -- this catches errors with the request itself
-        net.log("Request error posting mission status to DSM: " .. tostring(err_or_status))
-    elseif err_or_status ~= 200 then
-        -- this catches errors with the response received from the server
-        net.log("Response error posting mission status to DSM: " .. tostring(err_or_status) .. " -> " .. tostring(response))
+    if not request.connected then
+        -- connecting again tells how the connection is going. Waiting for the socket to be
+        -- writable isn't enough, failed connections are never writable on windows
+        local ok, err = request.sock:connect(dsm_ip, dsm_port)
+        if ok or err == "already connected" then
+            request.connected = true
+        elseif err == "timeout" or string.find(err, "in progress", 1, true) then
+            return nil
+        else
+            request.sock:close()
+            error("can't connect to DSM: " .. tostring(err))
+        end
+    end
+
+    if request.sent < #request.data then
+        local last_sent, err, partially_sent = request.sock:send(request.data, request.sent + 1)
+        request.sent = last_sent or partially_sent or request.sent
+        if err and err ~= "timeout" then
+            request.sock:close()
+            error("error sending: " .. tostring(err))
+        end
+        return nil
+    end
+
+    local data, err, partial_data = request.sock:receive("*a")
+    table.insert(request.received, data or partial_data or "")
+    if err == "timeout" then
+        return nil
+    end
+    request.sock:close()
+    if err and err ~= "closed" then
+        error("error receiving: " .. tostring(err))
+    end
+
+    local answer = table.concat(request.received)
+    local status = tonumber(string.match(answer, "^HTTP/%d%.%d (%d%d%d)"))
+    if status ~= 200 then
+        error("unexpected answer: " .. tostring(string.match(answer, "^[^\r\n]*")))
+    end
+    return net.json2lua(string.match(answer, "\r\n\r\n(.*)$") or "")
+end
+
+DsmHooks.post_status = function()
+    local status = DsmHooks.current_status()
+    local body = DsmHooks.build_update(status)
+    -- until DSM confirms it got this update, we can't be sure of what it knows
+    DsmHooks.known_by_dsm = nil
+    DsmHooks.status_request = DsmHooks.start_request("/dcs/mission_status", body, 15)
+    DsmHooks.status_request.status = status
+end
+
+DsmHooks.advance_status = function()
+    local ok, result = pcall(DsmHooks.advance_request, DsmHooks.status_request)
+    if not ok then
+        net.log("Error posting mission status to DSM: " .. tostring(result))
+        DsmHooks.status_request = nil
+    elseif result ~= nil then
+        -- the answer looks something like this: {"resync": false}
+        if not result.resync then
+            DsmHooks.known_by_dsm = DsmHooks.status_request.status
+        end
+        DsmHooks.status_request = nil
+    end
+end
+
+DsmHooks.poll_actions = function()
+    -- each poll acknowledges the actions executed since the previous one
+    local ack = {}
+    for i, action_id in ipairs(DsmHooks.actions_to_ack) do
+        ack[i] = action_id
+    end
+    DsmHooks.actions_request = DsmHooks.start_request(
+        "/dcs/actions", {ack = ack, wait = DsmHooks.actions_wait}, DsmHooks.actions_wait + 10
+    )
+    DsmHooks.actions_request.ack = ack
+end
+
+DsmHooks.advance_actions = function()
+    local ok, result = pcall(DsmHooks.advance_request, DsmHooks.actions_request)
+    if not ok then
+        -- the acknowledgements are sent again in the next poll
+        net.log("Error waiting for actions from DSM: " .. tostring(result))
+        DsmHooks.actions_request = nil
+        DsmHooks.actions_retry_at = socket.gettime() + DsmHooks.actions_retry_interval
+        return
+    elseif result == nil then
+        return
+    end
+
+    -- the answer looks something like this: {"actions": [{"id": 1, "action": "pause"}, ...]}
+    local acknowledged = {}
+    for _, action_id in ipairs(DsmHooks.actions_request.ack) do
+        acknowledged[action_id] = true
     end
+    DsmHooks.actions_request = nil
+    DsmHooks.actions_to_ack = {}
 
-    if response ~= nil and response ~= "" then
-        -- the response looks something like this: {"actions": ["pause", "unpause", ...]}
-        local actual_body = table.concat(response_body)
-        local actions = net.json2lua(actual_body).actions
-        for i, action in ipairs(actions or {}) do
+    for _, pending_action in ipairs(result.actions or {}) do
+        local action = pending_action.action
+        -- DSM already forgot the acknowledged actions, but better safe than pausing twice
+        if not acknowledged[pending_action.id] then
             net.log("Executing requested action from DSM: " .. action)
             if action == "pause" then
                 DCS.setPause(true)
@@ -68,17 +236,30 @@ DsmHooks.post_status = function()
                 net.log("Unknown action received from DSM: " .. action)
             end
         end
+        table.insert(DsmHooks.actions_to_ack, pending_action.id)
     end
 end
 
 DsmHooks.onSimulationFrame = function()
     local now = socket.gettime()
-    if now - DsmHooks.last_update > DsmHooks.update_interval then
+
+    if DsmHooks.status_request then
+        DsmHooks.advance_status()
+    elseif now - DsmHooks.last_update > DsmHooks.update_interval then
         DsmHooks.last_update = now
-        local result, err = pcall(DsmHooks.post_status)
-        if err then
-            -- this catches any unexpected errors that weren't caught in the request
-            net.log("Unknown error posting mission status to DSM: " .. tostring(err))
+        local ok, err = pcall(DsmHooks.post_status)
+        if not ok then
+            net.log("Error posting mission status to DSM: " .. tostring(err))
+        end
+    end
+
+    if DsmHooks.actions_request then
+        DsmHooks.advance_actions()
+    elseif now > DsmHooks.actions_retry_at then
+        local ok, err = pcall(DsmHooks.poll_actions)
+        if not ok then
+            net.log("Error waiting for actions from DSM: " .. tostring(err))
+            DsmHooks.actions_retry_at = now + DsmHooks.actions_retry_interval
         end
     end
 end